@@ -1,9 +1,18 @@
 import streamlit as st
-import tensorflow as tf
 from PIL import Image
-import numpy as np
+import csv
 import io
 import os
+import time
+
+# The plate images are only needed by the Ishihara endpoints
+os.environ.setdefault('OCULUSAI_PRELOAD_PLATES', '0')
+
+# Same preprocessing, retinal validation and inference as the API
+import flask_app
+from flask_app import BATCH_MAX_IMAGES, BATCH_PREDICT_SIZE, IMAGE_SIZE, class_names
+from bulk_score import CSV_FIELDS, csv_row
+from prediction_cache import PredictionCache
 
 # --- Page Configuration --- #
 st.set_page_config(
@@ -72,10 +81,8 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- Configuration --- #
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(BASE_DIR, 'eye_disease_model.keras')
-IMAGE_SIZE = (256, 256)
-class_names = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal']
+# Results memoized per upload, so Streamlit reruns don't run the model again
+PREDICTION_CACHE_ENTRIES = int(os.environ.get('OCULUSAI_STREAMLIT_CACHE_ENTRIES', 256))
 
 # Disease information
 disease_info = {
@@ -104,37 +111,115 @@ disease_info = {
 # --- Load Model --- #
 @st.cache_resource
 def load_model():
-    try:
-        model = tf.keras.models.load_model(MODEL_PATH)
-        return model
-    except Exception as e:
-        st.error(f"Error loading model: {str(e)}")
-        return None
+    flask_app.load_eye_disease_model()
+    if flask_app.app.model is None:
+        st.error("Error loading model, see the server log for details")
+    return flask_app.app.model
 
 # --- Prediction Function --- #
-def predict(model, img):
-    if isinstance(img, Image.Image):
-        img_array = tf.keras.utils.img_to_array(img)
-    else:
-        img_array = img
+def upload_key(data):
+    """Content hash of an upload, tied to the loaded model file (the API's prediction cache key)."""
+    return PredictionCache.key(data, flask_app.app.model_version)
+
+@st.cache_data(max_entries=PREDICTION_CACHE_ENTRIES, show_spinner=False)
+def predict(cache_key, _data):
+    """
+    Validate and classify one upload exactly as /api/predict does; returns (payload, status).
+    Memoized on `cache_key` alone - the leading underscore keeps Streamlit from hashing the bytes.
+    """
+    return flask_app.predict_fundus(io.BytesIO(_data))
+
+# --- Batch Analysis --- #
+def results_csv(results):
+    """Batch results in the bulk_score.py CSV layout."""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    writer.writerows(csv_row(result) for result in results)
+    return output.getvalue()
 
-    img_resized = Image.fromarray(img_array.astype('uint8')).resize(IMAGE_SIZE)
-    img_resized_array = tf.keras.utils.img_to_array(img_resized)
-    img_array_expanded = tf.expand_dims(img_resized_array, 0)
+def results_table(results):
+    """One row per image for st.dataframe; missing values are None so numeric columns sort as numbers."""
+    return [
+        {column: (None if value == '' else value) for column, value in csv_row(result).items()}
+        for result in results
+    ]
 
-    predictions = model.predict(img_array_expanded)
-    probabilities = tf.nn.softmax(predictions[0]).numpy()
+def analyze_batch(files, progress):
+    """
+    Score uploaded files (images or zips of images) with the API's batch pipeline:
+    decoded concurrently, validated and run through the model BATCH_PREDICT_SIZE at a time.
+    Returns (results, error_message).
+    """
+    # Fresh streams each time: an UploadedFile's position persists across reruns
+    uploads, error = flask_app.batch_uploads([(file.name, io.BytesIO(file.getvalue())) for file in files])
+    if error is not None:
+        payload, _ = error
+        return None, payload['error']
+    
+    results = []
+    for result in flask_app.predict_fundus_batch(uploads):
+        results.append(result)
+        if len(results) % BATCH_PREDICT_SIZE == 0 or len(results) == len(uploads):
+            progress.progress(len(results) / len(uploads), text=f"Analyzed {len(results)}/{len(uploads)} images")
+    return results, None
 
-    predicted_class = class_names[int(np.argmax(probabilities))]
-    confidence = round(100 * float(np.max(probabilities)), 2)
+def batch_mode(model):
+    st.markdown("### 📁 Batch Analysis")
+    files = st.file_uploader(
+        "Choose eye fundus images or zip archives...",
+        type=["jpg", "jpeg", "png", "zip"],
+        accept_multiple_files=True,
+        help=f"Up to {BATCH_MAX_IMAGES} images per batch"
+    )
+    
+    if files and model is not None and st.button(f"🔍 Analyze {len(files)} file(s)", type="primary"):
+        progress = st.progress(0.0, text="Decoding images...")
+        start = time.perf_counter()
+        results, error = analyze_batch(files, progress)
+        elapsed = time.perf_counter() - start
+        progress.empty()
+        if error is not None:
+            st.error(f"❌ {error}")
+        else:
+            # Kept across reruns, e.g. the one triggered by the download button
+            st.session_state['batch_results'] = results
+            st.session_state['batch_seconds'] = elapsed
+    
+    results = st.session_state.get('batch_results')
+    if not results:
+        return
+    
+    elapsed = st.session_state['batch_seconds']
+    scored = [result for result in results if result['status'] == 200]
+    st.markdown("### 📊 Batch Results")
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("Images", len(results))
+    metric_cols[1].metric("Classified", len(scored))
+    metric_cols[2].metric("Images/sec", f"{len(results) / elapsed:.1f}" if elapsed > 0 else "-")
     
-    return predicted_class, confidence, probabilities, img_resized
+    if scored:
+        class_counts = {class_name.replace('_', ' ').title(): 0 for class_name in class_names}
+        for result in scored:
+            class_counts[result['predicted_class'].replace('_', ' ').title()] += 1
+        st.bar_chart(class_counts)
+    
+    st.dataframe(results_table(results), use_container_width=True, hide_index=True)
+    st.download_button(
+        "⬇️ Download CSV",
+        data=results_csv(results),
+        file_name="oculusai_batch_results.csv",
+        mime="text/csv"
+    )
 
 # --- Main UI --- #
 st.markdown("<div class='header-section'><h1>👁️ VisionXAI</h1><p class='subtitle'>Advanced Eye Disease Detection powered by AI</p></div>", unsafe_allow_html=True)
 
 # Sidebar
 with st.sidebar:
+    st.markdown("### 🗂️ Mode")
+    mode = st.radio("Analysis mode", ["Single image", "Batch"], label_visibility="collapsed")
+    
     st.markdown("### 📋 About")
     st.info("""
     This application uses deep learning to detect:
@@ -159,68 +244,81 @@ with st.sidebar:
     Always consult a healthcare professional for medical advice.
     """)
 
-# Main content area
-col1, col2 = st.columns([1, 1])
+if mode == "Batch":
+    batch_mode(model)
+else:
+    # Main content area
+    col1, col2 = st.columns([1, 1])
 
-with col1:
-    st.markdown("### 📤 Upload Image")
-    uploaded_file = st.file_uploader(
-        "Choose an eye fundus image...",
-        type=["jpg", "jpeg", "png"],
-        help="Upload a clear retinal/fundus image for analysis"
-    )
-    
-    if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        st.image(image, caption='📷 Uploaded Image', use_column_width=True)
+    with col1:
+        st.markdown("### 📤 Upload Image")
+        uploaded_file = st.file_uploader(
+            "Choose an eye fundus image...",
+            type=["jpg", "jpeg", "png"],
+            help="Upload a clear retinal/fundus image for analysis"
+        )
+        
+        if uploaded_file is not None:
+            image = Image.open(uploaded_file)
+            st.image(image, caption='📷 Uploaded Image', use_column_width=True)
+
+    with col2:
+        if uploaded_file is not None and model is not None:
+            st.markdown("### 🔍 Analysis Results")
+            
+            with st.spinner('🔄 Analyzing image...'):
+                data = uploaded_file.getvalue()
+                result, status = predict(upload_key(data), data)
+            
+            if status != 200:
+                st.error(f"❌ {result['error']}")
+                if result.get('suggestion'):
+                    st.info(result['suggestion'])
+            else:
+                predicted_class = result['predicted_class']
+                confidence = result['confidence']
+                probabilities = [result['all_predictions'][class_name] / 100 for class_name in class_names]
+                
+                # Display main prediction
+                emoji = disease_info[predicted_class]['emoji']
+                st.markdown(f"""
+                <div class='prediction-card'>
+                    <h2 style='text-align: center; color: #667eea;'>{emoji} {predicted_class.replace('_', ' ').title()}</h2>
+                    <h1 style='text-align: center; color: #764ba2;'>{confidence}%</h1>
+                    <p style='text-align: center; color: #666;'>Confidence Score</p>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                # Disease information
+                st.markdown(f"""
+                <div class='info-box'>
+                    <h4>ℹ️ About {predicted_class.replace('_', ' ').title()}</h4>
+                    <p><strong>Description:</strong> {disease_info[predicted_class]['description']}</p>
+                    <p><strong>Common Symptoms:</strong> {disease_info[predicted_class]['symptoms']}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
-with col2:
-    if uploaded_file is not None and model is not None:
-        st.markdown("### 🔍 Analysis Results")
+    # Full-width confidence chart
+    if uploaded_file is not None and model is not None and status == 200:
+        st.markdown("---")
+        st.markdown("### 📊 Detailed Confidence Analysis")
         
-        with st.spinner('🔄 Analyzing image...'):
-            predicted_class, confidence, probabilities, processed_image = predict(model, image)
+        col1, col2, col3, col4 = st.columns(4)
         
-        # Display main prediction
-        emoji = disease_info[predicted_class]['emoji']
-        st.markdown(f"""
-        <div class='prediction-card'>
-            <h2 style='text-align: center; color: #667eea;'>{emoji} {predicted_class.replace('_', ' ').title()}</h2>
-            <h1 style='text-align: center; color: #764ba2;'>{confidence}%</h1>
-            <p style='text-align: center; color: #666;'>Confidence Score</p>
-        </div>
-        """, unsafe_allow_html=True)
+        for idx, (col, class_name) in enumerate(zip([col1, col2, col3, col4], class_names)):
+            with col:
+                st.markdown(f"""
+                <div class='metric-card'>
+                    <h4>{disease_info[class_name]['emoji']}</h4>
+                    <h3>{class_name.replace('_', ' ').title()}</h3>
+                    <h2>{probabilities[idx]*100:.1f}%</h2>
+                </div>
+                """, unsafe_allow_html=True)
         
-        # Disease information
-        st.markdown(f"""
-        <div class='info-box'>
-            <h4>ℹ️ About {predicted_class.replace('_', ' ').title()}</h4>
-            <p><strong>Description:</strong> {disease_info[predicted_class]['description']}</p>
-            <p><strong>Common Symptoms:</strong> {disease_info[predicted_class]['symptoms']}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-# Full-width confidence chart
-if uploaded_file is not None and model is not None:
-    st.markdown("---")
-    st.markdown("### 📊 Detailed Confidence Analysis")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    for idx, (col, class_name) in enumerate(zip([col1, col2, col3, col4], class_names)):
-        with col:
-            st.markdown(f"""
-            <div class='metric-card'>
-                <h4>{disease_info[class_name]['emoji']}</h4>
-                <h3>{class_name.replace('_', ' ').title()}</h3>
-                <h2>{probabilities[idx]*100:.1f}%</h2>
-            </div>
-            """, unsafe_allow_html=True)
-    
-    # Display confidence as a simple bar chart
-    st.markdown("### 📊 Confidence Scores")
-    confidence_data = {class_name.replace('_', ' ').title(): prob*100 for class_name, prob in zip(class_names, probabilities)}
-    st.bar_chart(confidence_data)
+        # Display confidence as a simple bar chart
+        st.markdown("### 📊 Confidence Scores")
+        confidence_data = {class_name.replace('_', ' ').title(): prob*100 for class_name, prob in zip(class_names, probabilities)}
+        st.bar_chart(confidence_data)
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,277 @@
+"""
+ASGI variant of the OculusAI API.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+Serves the same routes as flask_app.py with identical request formats and
+response payloads (both apps call the same handler functions), so the Next.js
+frontend can use either. Multipart uploads are received without blocking the
+event loop, and image decoding and model calls run in a bounded thread pool,
+so a slow upload or a long inference never stalls other requests.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from flask_app import (
+    BATCH_MAX_CONTENT_LENGTH,
+    BATCH_MAX_IMAGES,
+    REQUEST_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    REQUESTS_TOTAL,
+    STAGE_SECONDS,
+    app as state,
+    batch_uploads,
+    create_test_session,
+    evaluate_responses,
+    init_models,
+    plate_digit_result,
+    plate_image,
+    predict_fundus,
+    readiness_status,
+    record_adaptive_answer,
+    stream_fundus_batch,
+)
+from plate_cache import plate_headers
+
+# Upper bound on concurrent decode/inference jobs
+OFFLOAD_WORKERS = int(os.environ.get('OCULUSAI_ASGI_OFFLOAD_WORKERS', 8))
+MAX_CONTENT_LENGTH = state.config['MAX_CONTENT_LENGTH']
+
+_executor = ThreadPoolExecutor(max_workers=OFFLOAD_WORKERS, thread_name_prefix='asgi-offload')
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call in the bounded offload pool."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def iterate_blocking(iterator):
+    """Drive a blocking iterator from the offload pool, one item at a time."""
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            break
+        yield item
+
+
+class BodyTooLarge(Exception):
+    """The request body exceeded its size limit while it was being received."""
+
+
+def limit_body(request, max_bytes):
+    """
+    Return `request` with its body capped at `max_bytes`, or an error response.
+    The Content-Length header is checked up front, and the bytes actually
+    received are counted too, so a chunked upload (which has no Content-Length)
+    raises BodyTooLarge once it passes the limit.
+    """
+    content_length = request.headers.get('content-length')
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError:
+            return None, JSONResponse({'error': 'Invalid Content-Length header'}, status_code=400)
+        if declared > max_bytes:
+            return None, JSONResponse({'error': 'File too large'}, status_code=413)
+
+    receive = request.receive
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > max_bytes:
+                raise BodyTooLarge()
+        return message
+    return Request(request.scope, limited_receive), None
+
+
+def api_endpoint(handler):
+    """
+    Turn uncaught errors into the same 500 payload the Flask app returns, and
+    record the same request metrics (labelled with the handler name, which
+    matches the Flask endpoint name).
+    """
+    name = handler.__name__
+
+    async def endpoint(request):
+        start = time.perf_counter()
+        with REQUESTS_IN_FLIGHT.track(endpoint=name):
+            try:
+                response = await handler(request)
+            except BodyTooLarge:
+                response = JSONResponse({'error': 'File too large'}, status_code=413)
+            except Exception as e:
+                response = JSONResponse({'error': str(e)}, status_code=500)
+        REQUESTS_TOTAL.inc(endpoint=name, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=name)
+        return response
+    return endpoint
+
+
+def json_response(payload, status=200):
+    with STAGE_SECONDS.time(stage='jsonify'):
+        return JSONResponse(payload, status_code=status)
+
+
+@api_endpoint
+async def readiness(request):
+    payload, status = readiness_status()
+    return JSONResponse(payload, status_code=status)
+
+
+async def prometheus_metrics(request):
+    return Response(state.metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+@api_endpoint
+async def prediction_cache_stats(request):
+    return JSONResponse(state.prediction_cache.stats())
+
+
+@api_endpoint
+async def predict(request):
+    # Check if model is loaded
+    if state.model is None:
+        return JSONResponse({'error': 'Model not loaded'}, status_code=500)
+
+    request, error = limit_body(request, MAX_CONTENT_LENGTH)
+    if error is not None:
+        return error
+
+    with STAGE_SECONDS.time(stage='multipart_parse'):
+        form = await request.form()
+    try:
+        file = form.get('image')
+        if not isinstance(file, UploadFile):
+            return JSONResponse({'error': 'No image provided'}, status_code=400)
+        if file.filename == '':
+            return JSONResponse({'error': 'No file selected'}, status_code=400)
+
+        payload, status = await run_blocking(predict_fundus, file.file)
+    finally:
+        await form.close()
+    return json_response(payload, status)
+
+
+@api_endpoint
+async def predict_batch(request):
+    if state.model is None:
+        return JSONResponse({'error': 'Model not loaded'}, status_code=500)
+
+    request, error = limit_body(request, BATCH_MAX_CONTENT_LENGTH)
+    if error is not None:
+        return error
+
+    try:
+        form = await request.form(max_files=BATCH_MAX_IMAGES)
+    except HTTPException:
+        return JSONResponse({'error': f'Too many images; the limit is {BATCH_MAX_IMAGES} per request'}, status_code=400)
+    files = [(file.filename, file.file) for _, file in form.multi_items() if isinstance(file, UploadFile)]
+    uploads, error = batch_uploads(files)
+    if error is not None:
+        await form.close()
+        payload, status = error
+        return JSONResponse(payload, status_code=status)
+
+    # The spooled uploads are read while streaming, so the form is closed afterwards
+    results = iterate_blocking(stream_fundus_batch(uploads))
+    lines = (json.dumps(result) + '\n' async for result in results)
+    return StreamingResponse(lines, media_type='application/x-ndjson', background=BackgroundTask(form.close))
+
+
+@api_endpoint
+async def start_colorblindness_test(request):
+    # Spread plates evenly across colour types unless ?stratify=false
+    stratify = request.query_params.get('stratify', 'true').lower() != 'false'
+    adaptive = request.query_params.get('adaptive', 'false').lower() == 'true'
+    payload, status = await run_blocking(create_test_session, request.query_params.get('count', 20), stratify, adaptive)
+    return JSONResponse(payload, status_code=status)
+
+
+@api_endpoint
+async def get_ishihara_image(request):
+    plate, not_modified = plate_image(request.path_params['filename'], request.headers.get('if-none-match'))
+    if plate is None:
+        return JSONResponse({'error': 'Image not found'}, status_code=404)
+    if not_modified:
+        return Response(status_code=304, headers=plate_headers(plate.etag))
+    return Response(plate.data, media_type='image/png', headers=plate_headers(plate.etag))
+
+
+@api_endpoint
+async def predict_digit(request):
+    if state.ishihara_model is None:
+        return JSONResponse({'error': 'Ishihara model not loaded'}, status_code=500)
+
+    with STAGE_SECONDS.time(stage='json_parse'):
+        data = await request.json()
+    payload, status = await run_blocking(plate_digit_result, data.get('filename'))
+    return json_response(payload, status)
+
+
+@api_endpoint
+async def answer_adaptive_test(request):
+    if state.ishihara_model is None:
+        return JSONResponse({'error': 'Ishihara model not loaded'}, status_code=500)
+
+    with STAGE_SECONDS.time(stage='json_parse'):
+        data = await request.json()
+    payload, status = await run_blocking(
+        record_adaptive_answer, data.get('test_id'), data.get('filename'), data.get('user_answer'))
+    return json_response(payload, status)
+
+
+@api_endpoint
+async def evaluate_colorblindness_test(request):
+    if state.ishihara_model is None:
+        return JSONResponse({'error': 'Ishihara model not loaded'}, status_code=500)
+
+    with STAGE_SECONDS.time(stage='json_parse'):
+        data = await request.json()
+    payload, status = await run_blocking(evaluate_responses, data.get('responses', []), data.get('test_id'))
+    return json_response(payload, status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load and warm up models before accepting requests
+    await run_blocking(init_models)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/api/health/ready', readiness, methods=['GET']),
+        Route('/api/health/cache', prediction_cache_stats, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+        Route('/api/predict', predict, methods=['POST']),
+        Route('/api/predict/batch', predict_batch, methods=['POST']),
+        Route('/api/colorblindness/start-test', start_colorblindness_test, methods=['GET']),
+        Route('/api/colorblindness/image/{filename:path}', get_ishihara_image, methods=['GET']),
+        Route('/api/colorblindness/predict-digit', predict_digit, methods=['POST']),
+        Route('/api/colorblindness/answer', answer_adaptive_test, methods=['POST']),
+        Route('/api/colorblindness/evaluate', evaluate_colorblindness_test, methods=['POST']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
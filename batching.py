@@ -0,0 +1,114 @@
+"""
+Dynamic micro-batching for model inference.
+Concurrent requests that arrive within a short window are stacked into a single
+forward pass, and every caller receives only its own rows of the output.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects single-sample inference requests into batches.
+
+    A request that finds nothing else queued is dispatched at once, so an idle
+    server adds no batching delay. Requests that queued up while the model was
+    busy are gathered into one batch, which is dispatched as soon as it holds
+    `max_batch_size` samples, or once `max_wait_ms` has elapsed since its first
+    sample was taken - whichever comes first.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0, name='batcher'):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a forked worker process starts its own
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def submit(self, sample):
+        """
+        Queue a batch of samples (usually a batch of one) for inference.
+        Returns a Future resolving to the model output rows for those samples.
+        """
+        sample = np.asarray(sample)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((sample, future))
+        return future
+
+    def predict(self, sample, timeout=None):
+        """Blocking helper: submit `sample` and wait for its output rows."""
+        return self.submit(sample).result(timeout=timeout)
+
+    def pending(self):
+        """Number of requests waiting to be batched."""
+        return self._queue.qsize()
+
+    def _collect(self):
+        """
+        Block for the first request. If more are already waiting (they queued
+        while the previous batch ran), gather more until the batch is full or
+        the window closes; otherwise dispatch the lone request immediately.
+        """
+        first = self._queue.get()
+        batch = [first]
+        size = len(first[0])
+        if self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Skip callers that gave up before their batch ran
+            batch = [(sample, future) for sample, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                inputs = np.concatenate([sample for sample, _ in batch], axis=0)
+                outputs = np.asarray(self.predict_fn(inputs))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for sample, future in batch:
+                future.set_result(outputs[offset:offset + len(sample)])
+                offset += len(sample)
@@ -0,0 +1,167 @@
+"""
+Offline bulk scoring of a directory of fundus images.
+
+Streams every image under a directory (recursively) through the same pipeline
+as /api/predict/batch - parallel decode, retinal validation and batched
+inference, all from flask_app.py - and appends one result per image to a CSV
+or JSONL file as each batch finishes. The API's prediction cache is bypassed,
+so scoring an archive neither evicts its hot entries nor fills its disk tier.
+
+Runs are resumable: images already present in the output file are skipped, so
+an interrupted run picks up where it stopped. With --rescore-errors, images
+that failed with a 5xx are scored again and the new row supersedes the old one.
+
+Usage:
+    python bulk_score.py /data/fundus_archive --output scores.csv
+    python bulk_score.py /data/fundus_archive --output scores.jsonl --batch-size 32
+"""
+
+import argparse
+import csv
+import functools
+import json
+import os
+import sys
+import time
+
+# The plate images are only needed by the Ishihara endpoints
+os.environ.setdefault('OCULUSAI_PRELOAD_PLATES', '0')
+
+import flask_app
+from flask_app import BATCH_IMAGE_EXTENSIONS, class_names
+
+CSV_FIELDS = ['filename', 'status', 'predicted_class', 'confidence', *class_names, 'error']
+PROGRESS_INTERVAL = 10.0
+
+
+def find_images(data_dir):
+    """Image paths under `data_dir`, relative to it, in a stable order."""
+    paths = []
+    for root, dirs, files in os.walk(data_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(BATCH_IMAGE_EXTENSIONS) and not filename.startswith('.'):
+                paths.append(os.path.relpath(os.path.join(root, filename), data_dir))
+    return paths
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def output_format(output_path):
+    return 'jsonl' if output_path.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def scored_filenames(output_path, rescore_errors=False):
+    """Filenames already in an existing output file (optionally leaving out 5xx failures so they are retried)."""
+    if not os.path.exists(output_path):
+        return set()
+
+    with open(output_path, 'r', encoding='utf-8', newline='') as f:
+        if output_format(output_path) == 'jsonl':
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # A line cut off by an interrupted run; that image is scored again
+                    continue
+        else:
+            rows = list(csv.DictReader(f))
+    done = set()
+    for row in rows:
+        try:
+            status = int(row['status'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not (rescore_errors and status >= 500):
+            done.add(row['filename'])
+    return done
+
+
+def end_with_newline(output_path):
+    """Terminate a line cut off by an interrupted run, so appended rows start on a fresh line."""
+    with open(output_path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+
+def csv_row(result):
+    """Flatten an /api/predict result into the CSV columns (probabilities as percentages)."""
+    row = {
+        'filename': result['filename'],
+        'status': result['status'],
+        'predicted_class': result.get('predicted_class', ''),
+        'confidence': result.get('confidence', ''),
+        'error': result.get('error', '')
+    }
+    row.update({name: result.get('all_predictions', {}).get(name, '') for name in class_names})
+    return row
+
+
+def score_directory(data_dir, output_path, batch_size, rescore_errors=False):
+    paths = find_images(data_dir)
+    done = scored_filenames(output_path, rescore_errors)
+    pending = [path for path in paths if path not in done]
+    print(f"Found {len(paths)} images, {len(paths) - len(pending)} already scored, {len(pending)} to go")
+    if not pending:
+        return
+
+    fmt = output_format(output_path)
+    new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    if not new_file:
+        end_with_newline(output_path)
+    uploads = ((path, functools.partial(read_file, os.path.join(data_dir, path))) for path in pending)
+
+    start = last_report = time.perf_counter()
+    scored = 0
+    with open(output_path, 'a', encoding='utf-8', newline='') as f:
+        writer = None
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            if new_file:
+                writer.writeheader()
+
+        for result in flask_app.predict_fundus_batch(uploads, batch_size=batch_size, use_cache=False):
+            if writer is not None:
+                writer.writerow(csv_row(result))
+            else:
+                f.write(json.dumps(result) + '\n')
+            scored += 1
+
+            # Results land on disk batch by batch, so an interrupted run loses at most one batch
+            if scored % batch_size == 0 or scored == len(pending):
+                f.flush()
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                print(f"  {scored}/{len(pending)} images, {scored / (now - start):.1f} images/sec", flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"✓ Scored {scored} images in {elapsed:.1f}s ({scored / elapsed:.1f} images/sec) → {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory of fundus images with the eye disease model.')
+    parser.add_argument('data_dir', help='Directory of fundus images (searched recursively)')
+    parser.add_argument('--output', required=True, help='Results file, .csv or .jsonl (appended to when resuming)')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass')
+    parser.add_argument('--model', default=flask_app.MODEL_PATH, help='Path to the eye disease model')
+    parser.add_argument('--rescore-errors', action='store_true', help='Retry images whose earlier result was a 5xx error')
+    args = parser.parse_args()
+
+    flask_app.MODEL_PATH = args.model
+    flask_app.load_eye_disease_model()
+    if flask_app.app.model is None:
+        sys.exit(1)
+
+    score_directory(args.data_dir, args.output, args.batch_size, args.rescore_errors)
+
+
+if __name__ == '__main__':
+    main()
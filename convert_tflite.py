@@ -0,0 +1,166 @@
+"""
+Convert the Keras models to post-training-quantized TFLite models for the
+tflite inference backend (OCULUSAI_INFERENCE_BACKEND=tflite).
+
+Calibration uses Sample_Retinal_Images for the eye disease model and a seeded
+subset of CBTestImages for the Ishihara model. Each conversion then reports
+accuracy drift (agreement with the Keras model, and digit accuracy against the
+plate filenames) plus single-image CPU latency, and writes the report as JSON
+next to the .tflite file.
+
+Usage:
+    python convert_tflite.py [--quantization int8|dynamic] [--calibration-plates 200]
+"""
+
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from inference import CompiledModel, TFLiteModel, time_calls, tflite_model_path
+from ishihara_index import load_plate
+from plate_manifest import parse_ishihara_filename
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, 'eye_disease_model.keras')
+ISHIHARA_MODEL_PATH = os.path.join(BASE_DIR, 'ishihara_digit_model.keras')
+SAMPLE_RETINAL_DIR = os.path.join(BASE_DIR, 'Sample_Retinal_Images')
+ISHIHARA_DATA_DIR = os.path.join(BASE_DIR, 'CBTestImages')
+IMAGE_SIZE = (256, 256)
+ISHIHARA_IMAGE_SIZE = (128, 128)
+
+
+def load_fundus_images(data_dir):
+    """Load fundus images exactly as /api/predict preprocesses them (256×256, 0-255 float32)."""
+    images = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            image = Image.open(os.path.join(data_dir, filename)).convert('RGB')
+            images.append(np.asarray(image.resize(IMAGE_SIZE), dtype=np.float32))
+    return np.stack(images)
+
+
+def load_plate_split(data_dir, calibration_count, evaluation_count, seed=42):
+    """Return disjoint (calibration, evaluation, evaluation_labels) sets of Ishihara plates."""
+    filenames = sorted(f for f in os.listdir(data_dir) if f.endswith('.png') and parse_ishihara_filename(f))
+    random.Random(seed).shuffle(filenames)
+    calibration = filenames[:calibration_count]
+    evaluation = filenames[calibration_count:calibration_count + evaluation_count]
+
+    def load(names):
+        return np.stack([load_plate(os.path.join(data_dir, f)) for f in names]).astype(np.float32)
+
+    labels = np.array([parse_ishihara_filename(f)['digit'] for f in evaluation])
+    return load(calibration), load(evaluation), labels
+
+
+def convert(model, quantization, calibration):
+    """Convert a Keras model to TFLite with dynamic-range or int8 post-training quantization."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == 'int8':
+        # Full-integer weights and activations; float I/O so callers are unchanged
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+        converter.representative_dataset = representative_dataset
+    elif quantization != 'dynamic':
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+
+    return converter.convert()
+
+
+def compare(keras_model, tflite_model, images, labels=None, iterations=100):
+    """Measure accuracy drift and single-image latency of the TFLite model against Keras."""
+    keras_outputs = keras_model(images)
+    tflite_outputs = np.concatenate([tflite_model(images[i:i + 1]) for i in range(len(images))])
+    keras_top1 = np.argmax(keras_outputs, axis=1)
+    tflite_top1 = np.argmax(tflite_outputs, axis=1)
+
+    keras_ms = np.median(time_calls(keras_model, images[:1], iterations))
+    tflite_ms = np.median(time_calls(tflite_model, images[:1], iterations))
+
+    report = {
+        'images': len(images),
+        'top1_agreement': float(np.mean(keras_top1 == tflite_top1)),
+        'max_abs_output_diff': float(np.max(np.abs(keras_outputs - tflite_outputs))),
+        'keras_latency_ms': float(keras_ms),
+        'tflite_latency_ms': float(tflite_ms),
+        'speedup': float(keras_ms / tflite_ms)
+    }
+    if labels is not None:
+        report['keras_accuracy'] = float(np.mean(keras_top1 == labels))
+        report['tflite_accuracy'] = float(np.mean(tflite_top1 == labels))
+        report['accuracy_drift'] = report['tflite_accuracy'] - report['keras_accuracy']
+    return report
+
+
+def convert_and_report(name, model_path, input_shape, quantization, calibration, evaluation, labels=None):
+    print(f"\nConverting {name} model ({quantization}, {len(calibration)} calibration images)...")
+    model = tf.keras.models.load_model(model_path)
+    tflite_bytes = convert(model, quantization, calibration)
+
+    output_path = tflite_model_path(model_path, quantization)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_bytes)
+
+    report = compare(
+        CompiledModel(model, input_shape, jit_compile=False),
+        TFLiteModel(output_path, input_shape),
+        evaluation,
+        labels
+    )
+    report.update({
+        'model': os.path.basename(model_path),
+        'quantization': quantization,
+        'calibration_images': len(calibration),
+        'keras_size_mb': round(os.path.getsize(model_path) / 1e6, 2),
+        'tflite_size_mb': round(os.path.getsize(output_path) / 1e6, 2)
+    })
+
+    report_path = os.path.splitext(output_path)[0] + '.report.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✓ Saved {output_path} ({report['keras_size_mb']} MB → {report['tflite_size_mb']} MB)")
+    print(f"  Top-1 agreement with Keras: {report['top1_agreement'] * 100:.2f}% "
+          f"(max output diff {report['max_abs_output_diff']:.4f})")
+    if labels is not None:
+        print(f"  Digit accuracy: Keras {report['keras_accuracy'] * 100:.2f}% → "
+              f"TFLite {report['tflite_accuracy'] * 100:.2f}%")
+    print(f"  Single-image latency: Keras {report['keras_latency_ms']:.2f} ms → "
+          f"TFLite {report['tflite_latency_ms']:.2f} ms ({report['speedup']:.2f}x)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the Keras models to quantized TFLite models.')
+    parser.add_argument('--quantization', choices=['int8', 'dynamic'], default='int8')
+    parser.add_argument('--calibration-plates', type=int, default=200, help='Ishihara plates used for calibration')
+    parser.add_argument('--evaluation-plates', type=int, default=400, help='Held-out Ishihara plates used for the report')
+    args = parser.parse_args()
+
+    if os.path.exists(MODEL_PATH):
+        # Only a handful of sample fundus images ship with the repo, so they serve
+        # for both calibration and the drift check
+        fundus = load_fundus_images(SAMPLE_RETINAL_DIR)
+        convert_and_report('Eye disease', MODEL_PATH, (*IMAGE_SIZE, 3), args.quantization, fundus, fundus)
+    else:
+        print(f"Skipping eye disease model: {MODEL_PATH} not found")
+
+    if os.path.exists(ISHIHARA_MODEL_PATH):
+        calibration, evaluation, labels = load_plate_split(
+            ISHIHARA_DATA_DIR, args.calibration_plates, args.evaluation_plates)
+        convert_and_report('Ishihara digit', ISHIHARA_MODEL_PATH, (*ISHIHARA_IMAGE_SIZE, 3),
+                           args.quantization, calibration, evaluation, labels)
+    else:
+        print(f"Skipping Ishihara model: {ISHIHARA_MODEL_PATH} not found")
+
+
+if __name__ == '__main__':
+    main()
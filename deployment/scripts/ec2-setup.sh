@@ -42,7 +42,7 @@ source .venv/bin/activate
 # Install Python dependencies
 echo "Installing Python dependencies..."
 pip install --upgrade pip
-pip install tensorflow flask flask-cors pillow numpy
+pip install tensorflow flask flask-cors pillow numpy gunicorn
 
 echo ""
 echo "============================================"
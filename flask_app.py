@@ -1,12 +1,31 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
 import tensorflow as tf
 from PIL import Image
 import numpy as np
+import functools
+import io
+import itertools
+import json
 import os
-import random
-import re
+import threading
+import time
+import zipfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from adaptive_test import HYPOTHESES, PLATE_TYPE_SLOTS, diagnosis_hypothesis, is_settled, next_plate_type, posterior
+from batching import MicroBatcher
+from inference import INFERENCE_BACKEND, load_inference_model, softmax
+import metrics
+from ishihara_index import default_index_path, default_report_path, file_sha256, load_plate, load_report, update_index
+from plate_cache import PlateImageCache, etag_matches, plate_headers
+from plate_manifest import PlateManifest, parse_ishihara_filename
+from plate_store import PlateStore
+from prediction_cache import PredictionCache
+from session_store import SessionStore
 
 app = Flask(__name__)
 CORS(app)
@@ -21,6 +40,55 @@ IMAGE_SIZE = (256, 256)
 ISHIHARA_IMAGE_SIZE = (128, 128)
 class_names = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal']
 
+# Number of plates in a colour blindness test
+MIN_TEST_PLATES = 15
+MAX_TEST_PLATES = 30
+
+# Adaptive tests (start-test?adaptive=true) stop once one diagnosis reaches this
+# posterior probability and generate_diagnosis() agrees, but never before
+# ADAPTIVE_MIN_PLATES answers
+ADAPTIVE_MIN_PLATES = int(os.environ.get('OCULUSAI_ADAPTIVE_MIN_PLATES', 8))
+ADAPTIVE_CONFIDENCE = float(os.environ.get('OCULUSAI_ADAPTIVE_CONFIDENCE', 0.95))
+
+# Retinal validation: circle sizes scanned for the fundus, and the colour-check radius
+RETINA_RADIUS_FACTORS = (0.3, 0.35, 0.4, 0.45, 0.5)
+RETINA_COLOR_RADIUS_FACTOR = 0.4
+
+# Micro-batching for /api/predict - uploads that queue while the model is busy
+# share one forward pass; a lone upload on an idle server is dispatched at once
+PREDICT_MAX_BATCH_SIZE = int(os.environ.get('OCULUSAI_PREDICT_MAX_BATCH_SIZE', 8))
+PREDICT_MAX_WAIT_MS = float(os.environ.get('OCULUSAI_PREDICT_MAX_WAIT_MS', 5))
+
+# Thread pool for decoding images in parallel (PIL releases the GIL while decoding)
+DECODE_WORKERS = int(os.environ.get('OCULUSAI_DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+
+# /api/predict response cache, keyed by upload content and model version (0 MB disables it)
+PREDICTION_CACHE_MB = float(os.environ.get('OCULUSAI_PREDICTION_CACHE_MB', 64))
+PREDICTION_CACHE_TTL = float(os.environ.get('OCULUSAI_PREDICTION_CACHE_TTL', 24 * 3600))
+PREDICTION_CACHE_DIR = os.environ.get('OCULUSAI_PREDICTION_CACHE_DIR') or None
+PREDICTION_CACHE_DISK_MB = float(os.environ.get('OCULUSAI_PREDICTION_CACHE_DISK_MB', 1024))
+
+# Largest upload decoded, checked against the header before any pixels are decoded.
+# Bounds peak decode memory per request: JPEGs are decoded at 1/2-1/8 scale (see
+# preprocess_fundus), so ~2 MB even for a 40 MP photo; other formats decode at
+# full size, at most MAX_UPLOAD_PIXELS × 4 bytes (RGBA) plus a 3-byte RGB copy.
+MAX_UPLOAD_PIXELS = int(os.environ.get('OCULUSAI_MAX_UPLOAD_PIXELS', 40_000_000))
+
+# /api/predict/batch: images per forward pass, and limits per request (files or zip entries)
+BATCH_PREDICT_SIZE = int(os.environ.get('OCULUSAI_BATCH_PREDICT_SIZE', PREDICT_MAX_BATCH_SIZE))
+BATCH_MAX_IMAGES = int(os.environ.get('OCULUSAI_BATCH_MAX_IMAGES', 1000))
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('OCULUSAI_BATCH_MAX_MB', 512)) * 1024 * 1024
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Ishihara test sessions held server-side between start-test and evaluate. Set
+# OCULUSAI_SESSION_DB to a SQLite file to share them between worker processes.
+SESSION_STORE_MB = float(os.environ.get('OCULUSAI_SESSION_STORE_MB', 16))
+SESSION_TTL = float(os.environ.get('OCULUSAI_SESSION_TTL', 2 * 3600))
+SESSION_DB = os.environ.get('OCULUSAI_SESSION_DB') or None
+
+# Read every plate into memory at startup (otherwise each plate is read on first request)
+PRELOAD_PLATES = os.environ.get('OCULUSAI_PRELOAD_PLATES', '1') == '1'
+
 # Disease information
 disease_info = {
     'cataract': {
@@ -49,104 +117,949 @@ disease_info = {
     }
 }
 
-# Load model
-@app.before_request
-def load_model():
-    if not hasattr(app, 'model'):
-        try:
-            app.model = tf.keras.models.load_model(MODEL_PATH)
-            print("✅ Eye disease model loaded successfully")
-        except Exception as e:
-            print(f"❌ Error loading eye disease model: {str(e)}")
-            app.model = None
+# Models are loaded and warmed once at process start (see init_models)
+app.model = None
+app.model_version = None
+app.model_batcher = None
+app.ishihara_model = None
+app.ishihara_index = {}
+app.ishihara_report = None
+app.plate_store = None
+app.plate_manifest = PlateManifest(ISHIHARA_DATA_DIR)
+app.plate_images = PlateImageCache(ISHIHARA_DATA_DIR, preload=PRELOAD_PLATES)
+app.ready = threading.Event()
+app.warmup_seconds = None
+app.models_initialized = False
+_init_lock = threading.Lock()
+app.prediction_cache = PredictionCache(
+    max_bytes=PREDICTION_CACHE_MB * 1024 * 1024,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    disk_dir=PREDICTION_CACHE_DIR,
+    max_disk_bytes=PREDICTION_CACHE_DISK_MB * 1024 * 1024
+)
+app.test_sessions = SessionStore(
+    max_bytes=SESSION_STORE_MB * 1024 * 1024,
+    ttl_seconds=SESSION_TTL,
+    db_path=SESSION_DB
+)
+
+# Request and per-stage latency, exposed at /metrics. Under gunicorn,
+# OCULUSAI_METRICS_DIR lets any worker report the totals of all of them.
+METRICS_DIR = os.environ.get('OCULUSAI_METRICS_DIR') or None
+app.metrics = metrics.MetricsRegistry(multiprocess_dir=METRICS_DIR)
+REQUEST_SECONDS = app.metrics.histogram(
+    'oculusai_request_duration_seconds', 'Time spent handling a request.', ['endpoint'])
+REQUESTS_TOTAL = app.metrics.counter(
+    'oculusai_requests_total', 'Requests handled, by response status.', ['endpoint', 'status'])
+REQUESTS_IN_FLIGHT = app.metrics.gauge(
+    'oculusai_requests_in_flight', 'Requests currently being handled.', ['endpoint'])
+STAGE_SECONDS = app.metrics.histogram(
+    'oculusai_stage_duration_seconds', 'Time spent in each stage of request handling.', ['stage'])
+
+def collect_runtime_metrics():
+    """Scrape-time values: readiness, micro-batch queue depth, prediction cache and test session counters."""
+    collected = [('oculusai_ready', 'gauge', 'Whether both models are loaded and warmed up (in every worker).',
+                  int(app.ready.is_set()), 'min')]
+    if app.model_batcher is not None:
+        collected.append(('oculusai_predict_queue_depth', 'gauge',
+                          'Images waiting for a /api/predict micro-batch.', app.model_batcher.pending()))
     
-    if not hasattr(app, 'ishihara_model'):
+    stats = app.prediction_cache.stats()
+    counters = {
+        'hits': 'Prediction cache hits.',
+        'memory_hits': 'Prediction cache hits served from memory.',
+        'disk_hits': 'Prediction cache hits served from the disk tier.',
+        'misses': 'Prediction cache misses.',
+        'evictions': 'Responses evicted from memory to stay under the size cap.',
+        'expired': 'Responses dropped after their TTL.',
+        'disk_evictions': 'Disk-tier files deleted to stay under the disk budget.',
+        'disk_expired': 'Disk-tier files deleted after their TTL.'
+    }
+    for name, documentation in counters.items():
+        collected.append((f'oculusai_prediction_cache_{name}_total', 'counter', documentation, stats[name]))
+    collected.append(('oculusai_prediction_cache_entries', 'gauge', 'Responses held in memory.', stats['entries']))
+    collected.append(('oculusai_prediction_cache_bytes', 'gauge', 'Size of the responses held in memory.', stats['bytes']))
+    if stats['disk_tier']:
+        collected.append(('oculusai_prediction_cache_disk_bytes', 'gauge',
+                          'Size of the disk tier as of its last sweep, plus writes since.', stats['disk_bytes'], 'max'))
+    
+    stats = app.test_sessions.stats()
+    collected.append(('oculusai_test_sessions_created_total', 'counter', 'Ishihara test sessions started.', stats['created']))
+    collected.append(('oculusai_test_sessions_evictions_total', 'counter',
+                      'Test sessions evicted from memory to stay under the size cap.', stats['evictions']))
+    collected.append(('oculusai_test_sessions', 'gauge', 'Test sessions held in memory.', stats['entries']))
+    return collected
+
+app.metrics.register_callback(collect_runtime_metrics)
+
+def load_models():
+    """Load both models with the configured inference backend, and the precomputed Ishihara plate index."""
+    load_eye_disease_model()
+    load_ishihara_model()
+
+def load_eye_disease_model():
+    """Load the eye disease model and start its micro-batcher."""
+    try:
+        app.model = load_inference_model(MODEL_PATH, (*IMAGE_SIZE, 3))
+        print(f"✅ Eye disease model loaded successfully ({INFERENCE_BACKEND})")
+    except Exception as e:
+        print(f"❌ Error loading eye disease model: {str(e)}")
+        app.model = None
+
+    if app.model is not None:
+        # Cached predictions are only valid for the exact model file that produced them
+        app.model_version = f"{INFERENCE_BACKEND}:{file_sha256(app.model.model_path)}"
+        app.model_batcher = MicroBatcher(
+            app.model,
+            max_batch_size=PREDICT_MAX_BATCH_SIZE,
+            max_wait_ms=PREDICT_MAX_WAIT_MS,
+            name='eye-disease-batcher'
+        )
+
+def load_ishihara_model():
+    """Load the Ishihara digit model and bring its plate index up to date."""
+    try:
+        app.ishihara_model = load_inference_model(ISHIHARA_MODEL_PATH, (*ISHIHARA_IMAGE_SIZE, 3))
+        print(f"✅ Ishihara digit model loaded successfully ({INFERENCE_BACKEND})")
+    except Exception as e:
+        print(f"❌ Error loading Ishihara model: {str(e)}")
+        app.ishihara_model = None
+
+    print(f"✅ Ishihara plate manifest loaded ({len(app.plate_manifest)} plates)")
+
+    # Preprocessed plates, so plates are never decoded with PIL while serving
+    try:
+        app.plate_store = PlateStore.open(ISHIHARA_DATA_DIR)
+        print(f"✅ Ishihara plate store ready ({len(app.plate_store)} plates)")
+    except Exception as e:
+        print(f"❌ Error opening Ishihara plate store: {str(e)}")
+        app.plate_store = None
+
+    # The index is keyed to the model file actually being served
+    if app.ishihara_model is not None:
         try:
-            app.ishihara_model = tf.keras.models.load_model(ISHIHARA_MODEL_PATH)
-            print("✅ Ishihara digit model loaded successfully")
+            model_path = app.ishihara_model.model_path
+            index = update_index(app.ishihara_model, model_path, ISHIHARA_DATA_DIR,
+                                 default_index_path(model_path), plate_store=app.plate_store)
+            app.ishihara_index = index['plates']
+            print(f"✅ Ishihara plate index ready ({len(app.ishihara_index)} plates)")
         except Exception as e:
-            print(f"❌ Error loading Ishihara model: {str(e)}")
-            app.ishihara_model = None
+            print(f"❌ Error building Ishihara plate index: {str(e)}")
+        
+        # Quality and speed measured at training time, if the report matches this model file
+        report = load_report(default_report_path(model_path))
+        if report is not None and report.get('model', {}).get('sha256') != file_sha256(model_path):
+            print("❌ Ishihara evaluation report does not match the loaded model; ignoring it")
+        elif report is not None:
+            app.ishihara_report = report
+            single = report['latency'][0]
+            print(f"✅ Ishihara evaluation report: {report['accuracy']*100:.2f}% accuracy, "
+                  f"{single['p50_ms']:.2f} ms p50 at batch {single['batch_size']}")
+
+def warmup_models():
+    """
+    Run dummy forward passes at every batch size we serve, so graph tracing
+    (and XLA compilation, which is per shape) happens here rather than on the
+    first real requests.
+    """
+    if app.model is not None:
+        for batch_size in range(1, PREDICT_MAX_BATCH_SIZE + 1):
+            app.model(np.zeros((batch_size, *IMAGE_SIZE, 3), dtype=np.float32))
+    
+    if app.ishihara_model is not None:
+        for batch_size in range(1, MAX_TEST_PLATES + 1):
+            app.ishihara_model(np.zeros((batch_size, *ISHIHARA_IMAGE_SIZE, 3), dtype=np.float32))
+
+def init_models():
+    """Load and warm up both models; the app reports ready once this finishes."""
+    start = time.perf_counter()
+    load_models()
+    warmup_models()
+    app.warmup_seconds = round(time.perf_counter() - start, 2)
+    app.models_initialized = True
+    if app.model is not None and app.ishihara_model is not None:
+        app.ready.set()
+        print(f"✅ Models warmed up in {app.warmup_seconds}s")
+
+def ishihara_evaluation_summary():
+    """Headline numbers from the loaded Ishihara model's evaluation report, or None."""
+    report = app.ishihara_report
+    if report is None:
+        return None
+    return {
+        'accuracy': report['accuracy'],
+        'samples': report['samples'],
+        'latency_p50_ms': {str(result['batch_size']): result['p50_ms'] for result in report['latency']},
+        'created_at': report.get('created_at')
+    }
+
+def readiness_status():
+    """Readiness payload: ready once both models are loaded and warmed up."""
+    ready = app.ready.is_set()
+    status = {
+        'ready': ready,
+        'models': {
+            'eye_disease': app.model is not None,
+            'ishihara': app.ishihara_model is not None
+        },
+        'warmup_seconds': app.warmup_seconds,
+        'ishihara_evaluation': ishihara_evaluation_summary()
+    }
+    return status, 200 if ready else 503
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 200 once both models are loaded and warmed up, 503 until then."""
+    payload, status = readiness_status()
+    return jsonify(payload), status
+
+@app.before_request
+def ensure_models_loaded():
+    """
+    Fallback for WSGI hosts that never call init_models() (flask run, waitress,
+    gunicorn without gunicorn.conf.py): load the models on the first request.
+    """
+    if app.models_initialized:
+        return
+    with _init_lock:
+        if not app.models_initialized:
+            init_models()
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'not_found'
+    REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def count_request(response):
+    REQUESTS_TOTAL.inc(endpoint=g.metrics_endpoint, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'request_start' in g:
+        REQUESTS_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=g.metrics_endpoint)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, stage, queue and cache metrics for this process in the Prometheus text format."""
+    return Response(app.metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/health/cache', methods=['GET'])
+def prediction_cache_stats():
+    """Hit/miss counters of the /api/predict response cache."""
+    return jsonify(app.prediction_cache.stats()), 200
+
+@functools.lru_cache(maxsize=8)
+def retinal_geometry(h, w):
+    """
+    Precompute the radial layout used by is_retinal_image for an h×w image.
+    Each pixel is labelled with the smallest scanned circle that contains it
+    (len(RETINA_RADIUS_FACTORS) if it lies outside all of them), so a single
+    bincount gives the brightness inside every circle at once.
+    """
+    center_x, center_y = w // 2, h // 2
+    Y, X = np.ogrid[:h, :w]
+    dist_sq = ((X - center_x)**2 + (Y - center_y)**2).ravel()
+    
+    radii_sq = np.array([int(min(h, w) * factor)**2 for factor in RETINA_RADIUS_FACTORS])
+    ring = np.searchsorted(radii_sq, dist_sq, side='left')
+    inside_counts = np.cumsum(np.bincount(ring, minlength=len(radii_sq) + 1))[:-1]
+    outside_counts = h * w - inside_counts
+    
+    # Pixels used for the colour check
+    color_pixels = np.flatnonzero(dist_sq <= (min(h, w) * RETINA_COLOR_RADIUS_FACTOR)**2)
+    
+    for array in (ring, inside_counts, outside_counts, color_pixels):
+        array.setflags(write=False)
+    return ring, inside_counts, outside_counts, color_pixels
+
+# Precompute for the model input size
+retinal_geometry(*IMAGE_SIZE)
 
 def is_retinal_image(img_array):
     """
     Validate if the uploaded image is likely a retinal scan.
     Returns (is_valid, reason) tuple.
     """
+    return is_retinal_image_batch(img_array[:1])[0]
+
+def is_retinal_image_batch(img_batch):
+    """
+    Validate a batch of images (N×H×W×3) at once.
+    Returns a list of (is_valid, reason) tuples, one per image.
+    """
     try:
-        # Convert to numpy array for analysis
-        img = img_array[0]  # Remove batch dimension
+        imgs = np.asarray(img_batch, dtype=np.float32)
+        n, h, w = imgs.shape[:3]
+        ring, inside_counts, outside_counts, color_pixels = retinal_geometry(h, w)
+        n_rings = len(RETINA_RADIUS_FACTORS) + 1
         
         # 1. Check if image is too uniform (likely a solid color or simple image)
-        std_dev = np.std(img)
-        if std_dev < 8:  # Relaxed from 10
-            return False, "Image appears to be too uniform. Please upload a retinal scan image."
+        std_dev = imgs.reshape(n, -1).std(axis=1)
         
         # 2. Check for circular/elliptical shape typical of retinal images
-        # Convert to grayscale
-        gray = np.mean(img, axis=-1).astype(np.uint8)
-        h, w = gray.shape
+        # Convert to grayscale (same result as np.mean over channels, without the strided reduction)
+        gray = ((imgs[..., 0] + imgs[..., 1] + imgs[..., 2]) / 3).astype(np.uint8).reshape(n, -1)
         
-        # Create a circular mask representing where the retinal fundus should be
-        center_x, center_y = w // 2, h // 2
-        Y, X = np.ogrid[:h, :w]
+        # Brightness summed per ring for every image in one bincount, then
+        # accumulated outwards to get the total inside each circle
+        bins = ring + n_rings * np.arange(n)[:, None]
+        ring_sums = np.bincount(bins.ravel(), weights=gray.ravel(), minlength=n * n_rings).reshape(n, n_rings)
+        inside_sums = np.cumsum(ring_sums, axis=1)[:, :-1]
+        outside_sums = ring_sums.sum(axis=1, keepdims=True) - inside_sums
         
-        # Check multiple radii to find circular pattern - more flexible
-        found_circle = False
-        for radius_factor in [0.3, 0.35, 0.4, 0.45, 0.5]:  # Check more sizes
-            radius = int(min(h, w) * radius_factor)
-            circle_mask = ((X - center_x)**2 + (Y - center_y)**2) <= radius**2
-            
-            # Calculate brightness inside and outside the circle
-            inside_brightness = np.mean(gray[circle_mask])
-            outside_brightness = np.mean(gray[~circle_mask])
-            
-            # Retinal images have brighter center (inside circle) and darker edges (outside)
+        # Retinal images have brighter center (inside circle) and darker edges (outside)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inside_brightness = inside_sums / inside_counts
+            outside_brightness = outside_sums / outside_counts
             brightness_ratio = inside_brightness / (outside_brightness + 1)  # +1 to avoid division by zero
-            
-            # Relaxed threshold - diabetic retinopathy can have darker centers
-            if brightness_ratio > 1.15:  # Relaxed from 1.3
-                found_circle = True
-                break
         
-        if not found_circle:
-            return False, "No circular retinal fundus pattern detected. Please upload a retinal scan image."
+        # Relaxed threshold - diabetic retinopathy can have darker centers
+        found_circle = np.any(brightness_ratio > 1.15, axis=1)
         
         # 3. Check if edges are dark (typical black background of retinal images)
-        edge_pixels = np.concatenate([
-            gray[0, :].flatten(),      # Top edge
-            gray[-1, :].flatten(),     # Bottom edge
-            gray[:, 0].flatten(),      # Left edge
-            gray[:, -1].flatten()      # Right edge
-        ])
-        edge_mean = np.mean(edge_pixels)
-        
-        if edge_mean > 100:  # Relaxed from 80
-            return False, "Image edges are too bright. Retinal scans have dark backgrounds."
+        gray = gray.reshape(n, h, w)
+        edge_mean = np.concatenate([
+            gray[:, 0, :],      # Top edge
+            gray[:, -1, :],     # Bottom edge
+            gray[:, :, 0],      # Left edge
+            gray[:, :, -1]      # Right edge
+        ], axis=1).mean(axis=1)
         
         # 4. Check color distribution - retinal images have specific red/orange tones
-        r_channel = img[:, :, 0]
-        g_channel = img[:, :, 1]
-        b_channel = img[:, :, 2]
-        
-        # Only check color in the center circular region
-        center_mask = ((X - center_x)**2 + (Y - center_y)**2) <= (min(h, w) * 0.4)**2
+        # Only check color in the center circular region (channel-major so each mean is a contiguous reduction)
+        center = np.ascontiguousarray(imgs.reshape(n, h * w, -1).transpose(0, 2, 1)[:, :3, color_pixels])
+        mean_rgb = center.mean(axis=2)
         
-        mean_r = np.mean(r_channel[center_mask])
-        mean_g = np.mean(g_channel[center_mask])
-        mean_b = np.mean(b_channel[center_mask])
-        
-        # More lenient color check - diabetic retinopathy can have varied colors
-        # Just ensure it's not predominantly blue (which would indicate non-medical image)
-        if mean_b > mean_r or mean_r < 50:  # Relaxed conditions
-            return False, "Image color profile doesn't match retinal scans. Please upload a fundus photograph."
-        
-        return True, None
+        results = []
+        for i in range(n):
+            mean_r, _, mean_b = mean_rgb[i]
+            if std_dev[i] < 8:  # Relaxed from 10
+                results.append((False, "Image appears to be too uniform. Please upload a retinal scan image."))
+            elif not found_circle[i]:
+                results.append((False, "No circular retinal fundus pattern detected. Please upload a retinal scan image."))
+            elif edge_mean[i] > 100:  # Relaxed from 80
+                results.append((False, "Image edges are too bright. Retinal scans have dark backgrounds."))
+            elif mean_b > mean_r or mean_r < 50:
+                # More lenient color check - diabetic retinopathy can have varied colors
+                # Just ensure it's not predominantly blue (which would indicate non-medical image)
+                results.append((False, "Image color profile doesn't match retinal scans. Please upload a fundus photograph."))
+            else:
+                results.append((True, None))
+        return results
         
     except Exception as e:
         # If validation fails, reject the image to be safe
         print(f"Validation error: {str(e)}")
-        return False, "Unable to validate image format. Please ensure you upload a clear retinal scan."
+        return [(False, "Unable to validate image format. Please ensure you upload a clear retinal scan.")] * len(img_batch)
+
+# ==================== Request handling shared by the Flask and ASGI apps ====================
+# Each function returns (payload, status_code) so both apps produce identical responses.
+
+def oversized_rejection(size):
+    """Response for an upload whose header reports more than MAX_UPLOAD_PIXELS, else None."""
+    width, height = size
+    if width * height <= MAX_UPLOAD_PIXELS:
+        return None
+    return {
+        'error': f'Image is too large ({width}×{height}).',
+        'suggestion': f'Please upload an image of at most {MAX_UPLOAD_PIXELS / 1e6:g} megapixels.'
+    }, 413
+
+def preprocess_fundus(image):
+    """Decode an opened (not yet decoded) image and resize it to the model input (1×256×256×3 float32)."""
+    # JPEGs are decoded straight to the smallest DCT scale (1/2 to 1/8) that is
+    # still at least the model input size; a no-op for other formats
+    with STAGE_SECONDS.time(stage='fundus_decode'):
+        image.draft('RGB', IMAGE_SIZE)
+        image = image.convert('RGB')
+    
+    # Resize to model input size
+    with STAGE_SECONDS.time(stage='fundus_resize'):
+        img_resized = image.resize(IMAGE_SIZE)
+        img_array = tf.keras.utils.img_to_array(img_resized)
+    return np.expand_dims(img_array, axis=0)
+
+def retinal_rejection(error_message):
+    """Response for an upload that failed retinal validation."""
+    return {
+        'error': error_message,
+        'suggestion': 'Please upload a clear retinal fundus photograph for analysis.'
+    }, 400
+
+def fundus_result(probabilities):
+    """Build the /api/predict response from the model's class probabilities."""
+    predicted_class = class_names[int(np.argmax(probabilities))]
+    confidence = float(np.max(probabilities)) * 100
+    all_predictions = {
+        class_names[i]: round(float(probabilities[i]) * 100, 2)
+        for i in range(len(class_names))
+    }
+    
+    # Additional confidence check - if all predictions are too similar, image might not be retinal
+    max_prob = np.max(probabilities)
+    second_max_prob = np.partition(probabilities, -2)[-2]
+    
+    if max_prob < 0.4 or (max_prob - second_max_prob) < 0.1:
+        return {
+            'error': 'Unable to confidently classify this image. It may not be a retinal scan.',
+            'suggestion': 'Please ensure you upload a clear retinal fundus photograph.',
+            'all_predictions': all_predictions
+        }, 400
+    
+    # Prepare response with all confidence scores
+    return {
+        'predicted_class': predicted_class,
+        'confidence': round(confidence, 2),
+        'icon': disease_info[predicted_class]['icon'],
+        'description': disease_info[predicted_class]['description'],
+        'symptoms': disease_info[predicted_class]['symptoms'],
+        'color': disease_info[predicted_class]['color'],
+        'all_predictions': all_predictions
+    }, 200
+
+def predict_fundus(stream):
+    """Validate and classify one uploaded fundus image, reusing the cached response for a repeat upload."""
+    data = stream.read()
+    with STAGE_SECONDS.time(stage='cache_lookup'):
+        cache_key = PredictionCache.key(data, app.model_version)
+        cached = app.prediction_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    result = classify_fundus(io.BytesIO(data))
+    app.prediction_cache.put(cache_key, *result)
+    return result
+
+def classify_fundus(stream):
+    """Validate and classify one fundus image (no caching)."""
+    # Opening only parses the header, so oversized images are rejected before decoding
+    image = Image.open(stream)
+    rejection = oversized_rejection(image.size)
+    if rejection is not None:
+        return rejection
+    img_array = preprocess_fundus(image)
+    
+    # Validate if image is a retinal scan
+    with STAGE_SECONDS.time(stage='retinal_validation'):
+        is_valid, error_message = is_retinal_image(img_array)
+    if not is_valid:
+        return retinal_rejection(error_message)
+    
+    # Make prediction (batched with any concurrent uploads; includes the wait for the batch)
+    with STAGE_SECONDS.time(stage='fundus_forward'):
+        predictions = app.model_batcher.predict(img_array)
+    with STAGE_SECONDS.time(stage='softmax'):
+        probabilities = softmax(predictions[0])
+    with STAGE_SECONDS.time(stage='fundus_response'):
+        return fundus_result(probabilities)
+
+def read_zip_entry(archive, info):
+    """Read one image out of an uploaded zip, refusing entries larger than a single upload may be."""
+    if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+        raise ValueError(f'Image is too large ({info.file_size} bytes uncompressed).')
+    return archive.read(info)
+
+def batch_uploads(files):
+    """
+    Expand the files posted to /api/predict/batch into (filename, read) pairs,
+    one per image; zip archives contribute one pair per image entry.
+    Returns (uploads, None), or (None, (payload, status)) if the request is invalid.
+    """
+    uploads = []
+    for filename, stream in files:
+        if not filename:
+            continue
+        if not filename.lower().endswith('.zip'):
+            uploads.append((filename, stream.read))
+            continue
+        try:
+            archive = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile:
+            return None, ({'error': f'{filename} is not a valid zip archive'}, 400)
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                continue
+            if name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                uploads.append((info.filename, functools.partial(read_zip_entry, archive, info)))
+    
+    if not uploads:
+        return None, ({'error': 'No images provided'}, 400)
+    if len(uploads) > BATCH_MAX_IMAGES:
+        return None, ({'error': f'Too many images ({len(uploads)}); the limit is {BATCH_MAX_IMAGES} per request'}, 400)
+    return uploads, None
+
+def prepare_fundus(read, use_cache=True):
+    """
+    Read and decode one batch upload (runs in the decode pool).
+    Returns (cache_key, img_array, result): img_array is None when `result`
+    already holds the final response - a cache hit, a rejection or an error.
+    The cache_key is None if `use_cache` is off.
+    """
+    try:
+        data = read()
+        cache_key = None
+        if use_cache:
+            cache_key = PredictionCache.key(data, app.model_version)
+            cached = app.prediction_cache.get(cache_key)
+            if cached is not None:
+                return cache_key, None, cached
+        
+        image = Image.open(io.BytesIO(data))
+        rejection = oversized_rejection(image.size)
+        if rejection is not None:
+            if use_cache:
+                app.prediction_cache.put(cache_key, *rejection)
+            return cache_key, None, rejection
+        return cache_key, preprocess_fundus(image), None
+    except Exception as e:
+        return None, None, ({'error': str(e)}, 500)
+
+def score_fundus_batch(prepared):
+    """Validate and classify a batch of decoded uploads with one forward pass; returns one (payload, status) per upload."""
+    results = [result for _, _, result in prepared]
+    rows = [i for i, (_, img_array, _) in enumerate(prepared) if img_array is not None]
+    if not rows:
+        return results
+    
+    img_batch = np.concatenate([prepared[i][1] for i in rows])
+    with STAGE_SECONDS.time(stage='retinal_validation'):
+        checks = is_retinal_image_batch(img_batch)
+    keep = [j for j, (is_valid, _) in enumerate(checks) if is_valid]
+    for j, (is_valid, error_message) in enumerate(checks):
+        if not is_valid:
+            results[rows[j]] = retinal_rejection(error_message)
+    
+    if keep:
+        with STAGE_SECONDS.time(stage='fundus_forward'):
+            predictions = app.model(img_batch[keep])
+        probabilities = softmax(predictions)
+        for j, probs in zip(keep, probabilities):
+            results[rows[j]] = fundus_result(probs)
+    
+    for i in rows:
+        if prepared[i][0] is not None:
+            app.prediction_cache.put(prepared[i][0], *results[i])
+    return results
+
+def predict_fundus_batch(uploads, batch_size=BATCH_PREDICT_SIZE, use_cache=True):
+    """
+    Classify (filename, read) uploads in batches of `batch_size`, yielding
+    one result per image as soon as its batch is done. Each result is the
+    /api/predict payload plus 'filename' and 'status' (its HTTP status code).
+    The next batch is decoded while the current one runs through the model.
+    With `use_cache` off the prediction cache is neither read nor written,
+    so an offline run over an archive leaves the API's entries alone.
+    """
+    pool = get_decode_pool()
+    uploads = iter(uploads)
+    
+    def submit_next_batch():
+        batch = itertools.islice(uploads, batch_size)
+        return [(filename, pool.submit(prepare_fundus, read, use_cache)) for filename, read in batch]
+    
+    pending = submit_next_batch()
+    while pending:
+        current, pending = pending, submit_next_batch()
+        results = score_fundus_batch([future.result() for _, future in current])
+        for (filename, _), (payload, status) in zip(current, results):
+            yield {'filename': filename, 'status': status, **payload}
+
+def stream_fundus_batch(uploads):
+    """
+    predict_fundus_batch() for a streamed response. The 200 status is sent
+    before the first result, so if scoring fails part-way, every image not yet
+    reported gets a status 500 result instead of the stream just ending.
+    """
+    reported = 0
+    try:
+        for result in predict_fundus_batch(uploads):
+            reported += 1
+            yield result
+    except Exception as e:
+        print(f"❌ Batch prediction failed after {reported} of {len(uploads)} images: {str(e)}")
+        for filename, _ in uploads[reported:]:
+            yield {'filename': filename, 'status': 500, 'error': str(e)}
+
+def create_test_session(count=20, stratify=True, adaptive=False):
+    """
+    Select plates for a new colour blindness test and remember them under its test_id.
+    An adaptive test hands out one plate at a time (see record_adaptive_answer),
+    with `count` as the most it will show.
+    """
+    if app.ishihara_model is None:
+        return {'error': 'Ishihara model not loaded'}, 500
+    
+    # Clamp number of images (default 20, min 15, max 30)
+    num_images = min(MAX_TEST_PLATES, max(MIN_TEST_PLATES, int(count)))
+    
+    # Pick up plates added or removed since the manifest was built
+    app.plate_manifest.refresh_if_changed()
+    if len(app.plate_manifest) == 0:
+        return {'error': 'No Ishihara images found'}, 404
+    
+    if adaptive:
+        return create_adaptive_session(num_images)
+    
+    # Randomly select images
+    selected_images = app.plate_manifest.sample(num_images, stratify=stratify)
+    filenames = [img['filename'] for img in selected_images]
+    
+    # Keep the plates and their answers server-side, so evaluation is a lookup
+    with STAGE_SECONDS.time(stage='plate_lookup'):
+        entries = get_plate_predictions(filenames)
+    test_id = os.urandom(8).hex()
+    with STAGE_SECONDS.time(stage='session_store'):
+        app.test_sessions.put(test_id, {
+            'plates': {
+                img['filename']: {'digit': entry['digit'], 'type': img['type']}
+                for img, entry in zip(selected_images, entries)
+            }
+        })
+    
+    # Prepare test session
+    test_session = {
+        'test_id': test_id,
+        'total_images': len(selected_images),
+        'images': [
+            {
+                'id': i + 1,
+                'filename': img['filename'],
+                'type': img['type']
+            }
+            for i, img in enumerate(selected_images)
+        ]
+    }
+    return test_session, 200
+
+def adaptive_next_plate(session, current):
+    """
+    Add the next plate to an adaptive session: an unused plate of the most
+    informative colour type. Returns its image entry, or None if none is left.
+    """
+    state = session['adaptive']
+    plate_types = [t for t in app.plate_manifest.plate_types() if t < PLATE_TYPE_SLOTS]
+    while plate_types:
+        plate_type = next_plate_type(current, plate_types, state['totals'])
+        img = app.plate_manifest.sample_type(plate_type, exclude=session['plates'])
+        if img is not None:
+            break
+        plate_types.remove(plate_type)
+    else:
+        return None
+    
+    with STAGE_SECONDS.time(stage='plate_lookup'):
+        entry = get_plate_predictions([img['filename']])[0]
+    session['plates'][img['filename']] = {'digit': entry['digit'], 'type': img['type']}
+    state['pending'] = img['filename']
+    return {
+        'id': len(session['plates']),
+        'filename': img['filename'],
+        'type': img['type']
+    }
+
+def create_adaptive_session(max_plates):
+    """Start an adaptive test: the session holds one plate, and more are added as answers come in."""
+    session = {
+        'plates': {},
+        'adaptive': {
+            'max_plates': max_plates,
+            'pending': None,
+            'answered': 0,
+            'errors': [0] * PLATE_TYPE_SLOTS,
+            'totals': [0] * PLATE_TYPE_SLOTS
+        }
+    }
+    first_image = adaptive_next_plate(session, posterior(session['adaptive']['errors'], session['adaptive']['totals']))
+    if first_image is None:
+        return {'error': 'No Ishihara images found'}, 404
+    
+    test_id = os.urandom(8).hex()
+    with STAGE_SECONDS.time(stage='session_store'):
+        app.test_sessions.put(test_id, session, mutable=True)
+    
+    return {
+        'test_id': test_id,
+        'adaptive': True,
+        'max_images': max_plates,
+        'total_images': 1,
+        'images': [first_image]
+    }, 200
+
+def record_adaptive_answer(test_id, filename, user_answer):
+    """
+    Record the answer to an adaptive test's current plate and update the posterior.
+    Returns the next plate, or done=True once the diagnosis is settled; the
+    test is then scored with /evaluate as usual. The session is only saved if
+    no other answer was recorded since it was read, so an answer sent twice
+    (or to two workers at once) counts once.
+    """
+    if not test_id or filename is None or user_answer is None:
+        return {'error': 'test_id, filename and user_answer are required'}, 400
+    
+    with STAGE_SECONDS.time(stage='session_store'):
+        session, version = app.test_sessions.get_versioned(test_id)
+    if session is None:
+        return {
+            'error': 'Test session not found or expired',
+            'suggestion': 'Please start a new test.'
+        }, 404
+    state = session.get('adaptive')
+    if state is None:
+        return {'error': 'Not an adaptive test'}, 400
+    if state['pending'] is None:
+        return {'error': 'This test is already complete'}, 400
+    if filename != state['pending']:
+        return {'error': 'Answer does not match the current plate'}, 400
+    
+    plate = session['plates'][filename]
+    state['answered'] += 1
+    state['totals'][plate['type']] += 1
+    state['errors'][plate['type']] += int(user_answer != plate['digit'])
+    
+    current = posterior(state['errors'], state['totals'])
+    # Only stop once /evaluate would diagnose what the posterior settled on
+    diagnosis = generate_diagnosis(color_type_probabilities(state['totals'], state['errors']))
+    next_image = None
+    if not is_settled(current, diagnosis_hypothesis(diagnosis), state['answered'],
+                      ADAPTIVE_MIN_PLATES, state['max_plates'], ADAPTIVE_CONFIDENCE):
+        next_image = adaptive_next_plate(session, current)
+    if next_image is None:
+        state['pending'] = None
+    
+    with STAGE_SECONDS.time(stage='session_store'):
+        updated = app.test_sessions.update(test_id, session, version)
+    if not updated:
+        return {'error': 'This plate was already answered'}, 409
+    
+    return {
+        'test_id': test_id,
+        'answered': state['answered'],
+        'done': next_image is None,
+        'next_image': next_image,
+        'posterior': {name: round(float(p), 4) for name, p in zip(HYPOTHESES, current)}
+    }, 200
+
+def plate_image(filename, if_none_match=None):
+    """
+    Look up a plate for serving. Returns (plate, not_modified): plate is None if
+    there is no such plate, and not_modified is True if the client's cached copy
+    (If-None-Match) is current.
+    """
+    plate = app.plate_images.get(filename)
+    if plate is None:
+        return None, False
+    return plate, etag_matches(if_none_match, plate.etag)
+
+_decode_pool = None
+_decode_pool_pid = None
+_decode_pool_lock = threading.Lock()
+
+def get_decode_pool():
+    """Return this process's decode thread pool (threads do not survive fork)."""
+    global _decode_pool, _decode_pool_pid
+    with _decode_pool_lock:
+        if _decode_pool is None or _decode_pool_pid != os.getpid():
+            _decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+            _decode_pool_pid = os.getpid()
+        return _decode_pool
+
+def get_plate_predictions(filenames):
+    """
+    Look up the model's answers for plates in the precomputed index.
+    Plates missing from the index are read from the plate store (or, for plates
+    added since it was built, decoded in parallel) and classified in a single
+    batched forward pass, then cached in memory.
+    Returns one entry per filename, or None where the plate does not exist.
+    """
+    missing = [
+        filename for filename in dict.fromkeys(filenames)
+        if filename not in app.ishihara_index
+        and os.path.exists(os.path.join(ISHIHARA_DATA_DIR, filename))
+    ]
+    
+    if missing:
+        store = app.plate_store
+        in_store = [filename for filename in missing if store is not None and filename in store]
+        on_disk = [filename for filename in missing if store is None or filename not in store]
+        missing = in_store + on_disk
+        with STAGE_SECONDS.time(stage='plate_decode'):
+            batches = []
+            if in_store:
+                batches.append(store.images(in_store))
+            if on_disk:
+                image_paths = [os.path.join(ISHIHARA_DATA_DIR, filename) for filename in on_disk]
+                batches.append(np.stack(list(get_decode_pool().map(load_plate, image_paths))))
+            img_batch = np.concatenate(batches)
+        with STAGE_SECONDS.time(stage='plate_forward'):
+            predictions = app.ishihara_model(img_batch)
+        with STAGE_SECONDS.time(stage='softmax'):
+            probabilities = softmax(predictions)
+        for filename, prediction, probs in zip(missing, predictions, probabilities):
+            app.ishihara_index[filename] = {
+                'digit': int(np.argmax(prediction)),
+                'probabilities': probs.tolist()
+            }
+    
+    return [app.ishihara_index.get(filename) for filename in filenames]
+
+def plate_digit_result(filename):
+    """The model's digit prediction for one plate."""
+    if not filename:
+        return {'error': 'No filename provided'}, 400
+    
+    with STAGE_SECONDS.time(stage='plate_lookup'):
+        entry = get_plate_predictions([filename])[0]
+    if entry is None:
+        return {'error': 'Image not found'}, 404
+    
+    probabilities = entry['probabilities']
+    predicted_digit = entry['digit']
+    confidence = float(np.max(probabilities)) * 100
+    
+    return {
+        'predicted_digit': predicted_digit,
+        'confidence': round(confidence, 2),
+        'all_probabilities': {
+            str(i): round(float(probabilities[i]) * 100, 2)
+            for i in range(10)
+        }
+    }, 200
+
+def session_answers(responses, plates):
+    """
+    Match responses against a stored test session: (filename, user_answer, color_type, correct_digit)
+    for each response to one of the session's plates. Other responses are ignored.
+    """
+    answered = []
+    for response in responses:
+        plate = plates.get(response.get('filename'))
+        user_answer = response.get('user_answer')
+        if plate is None or user_answer is None:
+            continue
+        answered.append((response['filename'], user_answer, plate['type'], plate['digit']))
+    return answered
+
+def filename_answers(responses):
+    """
+    Answers for a test without a stored session: colour types are parsed from the
+    filenames the client sent and the plates are looked up (or classified) again.
+    """
+    # Keep only well-formed responses for known plates
+    answered = []
+    for response in responses:
+        filename = response.get('filename')
+        user_answer = response.get('user_answer')
+        
+        if filename is None or user_answer is None:
+            continue
+        
+        # Get color type from filename
+        parsed = parse_ishihara_filename(filename)
+        if not parsed:
+            continue
+        
+        answered.append((filename, user_answer, parsed['type']))
+    
+    # Get model predictions (ground truth) for all plates at once
+    with STAGE_SECONDS.time(stage='plate_lookup'):
+        entries = get_plate_predictions([filename for filename, _, _ in answered])
+    
+    results = []
+    for (filename, user_answer, color_type), entry in zip(answered, entries):
+        if entry is None:
+            raise FileNotFoundError(f"Image not found: {filename}")
+        results.append((filename, user_answer, color_type, entry['digit']))
+    return results
+
+def color_type_probabilities(totals, mistakes):
+    """Error and normal percentages per colour type (1-4), from per-type plate and mistake counts."""
+    type_probabilities = {}
+    for color_type in (1, 2, 3, 4):
+        total = int(totals[color_type])
+        if total > 0:
+            error_rate = (int(mistakes[color_type]) / total) * 100
+            normal_rate = 100 - error_rate
+            type_probabilities[color_type] = {
+                'error_percentage': round(error_rate, 1),
+                'normal_percentage': round(normal_rate, 1),
+                'mistakes': int(mistakes[color_type]),
+                'total': total
+            }
+        else:
+            type_probabilities[color_type] = {
+                'error_percentage': 0,
+                'normal_percentage': 100,
+                'mistakes': 0,
+                'total': 0
+            }
+    return type_probabilities
+
+def evaluate_responses(responses, test_id=None):
+    """
+    Score a completed test and diagnose from the per-colour-type error rates.
+    With a `test_id` from start-test, answers come from the stored session;
+    without one, they are re-derived from the filenames in the responses.
+    """
+    if not responses:
+        return {'error': 'No responses provided'}, 400
+    
+    total_questions = len(responses)
+    
+    if test_id:
+        with STAGE_SECONDS.time(stage='session_store'):
+            session = app.test_sessions.get(test_id)
+        if session is None:
+            return {
+                'error': 'Test session not found or expired',
+                'suggestion': 'Please start a new test.'
+            }, 404
+        answered = session_answers(responses, session['plates'])
+    else:
+        answered = filename_answers(responses)
+    
+    detailed_results = []
+    for filename, user_answer, color_type, correct_digit in answered:
+        detailed_results.append({
+            'filename': filename,
+            'correct_digit': correct_digit,
+            'user_answer': user_answer,
+            'is_correct': user_answer == correct_digit,
+            'color_type': color_type
+        })
+    
+    # Statistics by color type
+    # 1: Greens vs Oranges (Deutan), 2: Oranges vs Greens (Protan)
+    # 3: Gray/Black vs Red/Pink (Protan), 4: Yellow/Orange vs Greens (Deutan)
+    color_types = np.array([r['color_type'] for r in detailed_results], dtype=np.int64)
+    is_correct = np.array([r['is_correct'] for r in detailed_results], dtype=bool)
+    totals = np.bincount(color_types, minlength=5)
+    mistakes = np.bincount(color_types[~is_correct], minlength=5)
+    total_correct = int(np.count_nonzero(is_correct))
+    
+    type_probabilities = color_type_probabilities(totals, mistakes)
+    
+    # Generate diagnosis
+    with STAGE_SECONDS.time(stage='diagnosis'):
+        diagnosis = generate_diagnosis(type_probabilities)
+    
+    # Overall accuracy
+    overall_accuracy = (total_correct / total_questions) * 100 if total_questions > 0 else 0
+    
+    return {
+        'overall_accuracy': round(overall_accuracy, 1),
+        'total_correct': total_correct,
+        'total_questions': total_questions,
+        'type_analysis': type_probabilities,
+        'diagnosis': diagnosis,
+        'detailed_results': detailed_results
+    }, 200
+
+# ==================== Retina Analysis Endpoint ====================
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
@@ -156,126 +1069,75 @@ def predict():
             return jsonify({'error': 'Model not loaded'}), 500
         
         # Get image from request
-        if 'image' not in request.files:
+        with STAGE_SECONDS.time(stage='multipart_parse'):
+            files = request.files
+        if 'image' not in files:
             return jsonify({'error': 'No image provided'}), 400
         
-        file = request.files['image']
+        file = files['image']
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Open and process image
-        image = Image.open(file.stream).convert('RGB')
-        
-        # Resize to model input size
-        img_resized = image.resize(IMAGE_SIZE)
-        img_array = tf.keras.utils.img_to_array(img_resized)
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        # Validate if image is a retinal scan
-        is_valid, error_message = is_retinal_image(img_array)
-        if not is_valid:
-            return jsonify({
-                'error': error_message,
-                'suggestion': 'Please upload a clear retinal fundus photograph for analysis.'
-            }), 400
-        
-        # Make prediction
-        predictions = app.model.predict(img_array, verbose=0)
-        probabilities = tf.nn.softmax(predictions[0]).numpy()
-        
-        predicted_class = class_names[int(np.argmax(probabilities))]
-        confidence = float(np.max(probabilities)) * 100
+        payload, status = predict_fundus(file.stream)
+        with STAGE_SECONDS.time(stage='jsonify'):
+            return jsonify(payload), status
+    
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Classify many fundus images in one request: any number of files, or zip
+    archives of images. Results are streamed as NDJSON, one line per image.
+    """
+    try:
+        if app.model is None:
+            return jsonify({'error': 'Model not loaded'}), 500
         
-        # Additional confidence check - if all predictions are too similar, image might not be retinal
-        max_prob = np.max(probabilities)
-        second_max_prob = np.partition(probabilities, -2)[-2]
+        request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+        files = [file for _, file in request.files.items(multi=True)]
+        uploads, error = batch_uploads([(file.filename, file.stream) for file in files])
+        if error is not None:
+            payload, status = error
+            return jsonify(payload), status
         
-        if max_prob < 0.4 or (max_prob - second_max_prob) < 0.1:
-            return jsonify({
-                'error': 'Unable to confidently classify this image. It may not be a retinal scan.',
-                'suggestion': 'Please ensure you upload a clear retinal fundus photograph.',
-                'all_predictions': {
-                    class_names[i]: round(float(probabilities[i]) * 100, 2)
-                    for i in range(len(class_names))
-                }
-            }), 400
+        # Flask closes request.files when this view returns, but the uploads are
+        # read while the response streams, so the response takes them over
+        request.files = MultiDict()
         
-        # Prepare response with all confidence scores
-        result = {
-            'predicted_class': predicted_class,
-            'confidence': round(confidence, 2),
-            'icon': disease_info[predicted_class]['icon'],
-            'description': disease_info[predicted_class]['description'],
-            'symptoms': disease_info[predicted_class]['symptoms'],
-            'color': disease_info[predicted_class]['color'],
-            'all_predictions': {
-                class_names[i]: round(float(probabilities[i]) * 100, 2)
-                for i in range(len(class_names))
-            }
-        }
+        def generate():
+            try:
+                for result in stream_fundus_batch(uploads):
+                    yield json.dumps(result) + '\n'
+            finally:
+                for file in files:
+                    file.close()
         
-        return jsonify(result)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
     
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ==================== Ishihara Colour Blindness Test Endpoints ====================
 
-def parse_ishihara_filename(filename):
-    """Parse Ishihara image filename to extract digit, font, and color type."""
-    match = re.match(r'(\d)_(.+?)theme_\d+ type_(\d)', filename)
-    if match:
-        return {
-            'digit': int(match.group(1)),
-            'font': match.group(2),
-            'type': int(match.group(3))
-        }
-    return None
-
 @app.route('/api/colorblindness/start-test', methods=['GET'])
 def start_colorblindness_test():
     """
     Start a new colour blindness test.
-    Selects 15-20 random images from the Ishihara dataset.
+    Selects 15-30 random images from the Ishihara dataset, spread evenly across colour types.
     """
     try:
-        # Get number of images (default 20, min 15, max 30)
-        num_images = min(30, max(15, int(request.args.get('count', 20))))
-        
-        # Get all available images
-        all_files = [f for f in os.listdir(ISHIHARA_DATA_DIR) if f.endswith('.png')]
-        
-        if not all_files:
-            return jsonify({'error': 'No Ishihara images found'}), 404
-        
-        # Parse all files
-        image_data = []
-        for filename in all_files:
-            parsed = parse_ishihara_filename(filename)
-            if parsed:
-                image_data.append({
-                    'filename': filename,
-                    **parsed
-                })
-        
-        # Randomly select images
-        selected_images = random.sample(image_data, min(num_images, len(image_data)))
-        
-        # Prepare test session
-        test_session = {
-            'test_id': os.urandom(8).hex(),
-            'total_images': len(selected_images),
-            'images': [
-                {
-                    'id': i + 1,
-                    'filename': img['filename'],
-                    'type': img['type']
-                }
-                for i, img in enumerate(selected_images)
-            ]
-        }
-        
-        return jsonify(test_session)
+        # Spread plates evenly across colour types unless ?stratify=false
+        stratify = request.args.get('stratify', 'true').lower() != 'false'
+        # ?adaptive=true hands out plates one at a time and stops early
+        adaptive = request.args.get('adaptive', 'false').lower() == 'true'
+        payload, status = create_test_session(request.args.get('count', 20), stratify, adaptive)
+        return jsonify(payload), status
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -284,10 +1146,12 @@ def start_colorblindness_test():
 def get_ishihara_image(filename):
     """Serve an Ishihara test image."""
     try:
-        image_path = os.path.join(ISHIHARA_DATA_DIR, filename)
-        if not os.path.exists(image_path):
+        plate, not_modified = plate_image(filename, request.headers.get('If-None-Match'))
+        if plate is None:
             return jsonify({'error': 'Image not found'}), 404
-        return send_file(image_path, mimetype='image/png')
+        if not_modified:
+            return Response(status=304, headers=plate_headers(plate.etag))
+        return Response(plate.data, mimetype='image/png', headers=plate_headers(plate.etag))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -301,39 +1165,30 @@ def predict_digit():
         if app.ishihara_model is None:
             return jsonify({'error': 'Ishihara model not loaded'}), 500
         
-        data = request.json
-        filename = data.get('filename')
-        
-        if not filename:
-            return jsonify({'error': 'No filename provided'}), 400
-        
-        # Load and preprocess image
-        image_path = os.path.join(ISHIHARA_DATA_DIR, filename)
-        if not os.path.exists(image_path):
-            return jsonify({'error': 'Image not found'}), 404
-        
-        image = Image.open(image_path).convert('RGB')
-        img_resized = image.resize(ISHIHARA_IMAGE_SIZE)
-        img_array = np.array(img_resized) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        # Make prediction
-        predictions = app.ishihara_model.predict(img_array, verbose=0)
-        probabilities = tf.nn.softmax(predictions[0]).numpy()
-        
-        predicted_digit = int(np.argmax(probabilities))
-        confidence = float(np.max(probabilities)) * 100
-        
-        result = {
-            'predicted_digit': predicted_digit,
-            'confidence': round(confidence, 2),
-            'all_probabilities': {
-                str(i): round(float(probabilities[i]) * 100, 2)
-                for i in range(10)
-            }
-        }
+        with STAGE_SECONDS.time(stage='json_parse'):
+            data = request.json
+        payload, status = plate_digit_result(data.get('filename'))
+        with STAGE_SECONDS.time(stage='jsonify'):
+            return jsonify(payload), status
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/colorblindness/answer', methods=['POST'])
+def answer_adaptive_test():
+    """
+    Answer the current plate of an adaptive test.
+    Returns the next plate to show, or done once the diagnosis is settled.
+    """
+    try:
+        if app.ishihara_model is None:
+            return jsonify({'error': 'Ishihara model not loaded'}), 500
         
-        return jsonify(result)
+        with STAGE_SECONDS.time(stage='json_parse'):
+            data = request.json
+        payload, status = record_adaptive_answer(data.get('test_id'), data.get('filename'), data.get('user_answer'))
+        with STAGE_SECONDS.time(stage='jsonify'):
+            return jsonify(payload), status
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -348,103 +1203,11 @@ def evaluate_colorblindness_test():
         if app.ishihara_model is None:
             return jsonify({'error': 'Ishihara model not loaded'}), 500
         
-        data = request.json
-        responses = data.get('responses', [])
-        
-        if not responses:
-            return jsonify({'error': 'No responses provided'}), 400
-        
-        # Statistics by color type
-        type_stats = {
-            1: {'total': 0, 'mistakes': 0},  # Greens vs Oranges (Deutan)
-            2: {'total': 0, 'mistakes': 0},  # Oranges vs Greens (Protan)
-            3: {'total': 0, 'mistakes': 0},  # Gray/Black vs Red/Pink (Protan)
-            4: {'total': 0, 'mistakes': 0}   # Yellow/Orange vs Greens (Deutan)
-        }
-        
-        total_correct = 0
-        total_questions = len(responses)
-        detailed_results = []
-        
-        # Process each response
-        for response in responses:
-            filename = response.get('filename')
-            user_answer = response.get('user_answer')
-            
-            if filename is None or user_answer is None:
-                continue
-            
-            # Get color type from filename
-            parsed = parse_ishihara_filename(filename)
-            if not parsed:
-                continue
-            
-            color_type = parsed['type']
-            
-            # Get model prediction (ground truth)
-            image_path = os.path.join(ISHIHARA_DATA_DIR, filename)
-            image = Image.open(image_path).convert('RGB')
-            img_resized = image.resize(ISHIHARA_IMAGE_SIZE)
-            img_array = np.array(img_resized) / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-            
-            predictions = app.ishihara_model.predict(img_array, verbose=0)
-            correct_digit = int(np.argmax(predictions[0]))
-            
-            # Compare with user answer
-            is_correct = (user_answer == correct_digit)
-            
-            if is_correct:
-                total_correct += 1
-            else:
-                type_stats[color_type]['mistakes'] += 1
-            
-            type_stats[color_type]['total'] += 1
-            
-            detailed_results.append({
-                'filename': filename,
-                'correct_digit': correct_digit,
-                'user_answer': user_answer,
-                'is_correct': is_correct,
-                'color_type': color_type
-            })
-        
-        # Calculate probabilities for each type
-        type_probabilities = {}
-        for color_type, stats in type_stats.items():
-            if stats['total'] > 0:
-                error_rate = (stats['mistakes'] / stats['total']) * 100
-                normal_rate = 100 - error_rate
-                type_probabilities[color_type] = {
-                    'error_percentage': round(error_rate, 1),
-                    'normal_percentage': round(normal_rate, 1),
-                    'mistakes': stats['mistakes'],
-                    'total': stats['total']
-                }
-            else:
-                type_probabilities[color_type] = {
-                    'error_percentage': 0,
-                    'normal_percentage': 100,
-                    'mistakes': 0,
-                    'total': 0
-                }
-        
-        # Generate diagnosis
-        diagnosis = generate_diagnosis(type_probabilities)
-        
-        # Overall accuracy
-        overall_accuracy = (total_correct / total_questions) * 100 if total_questions > 0 else 0
-        
-        result = {
-            'overall_accuracy': round(overall_accuracy, 1),
-            'total_correct': total_correct,
-            'total_questions': total_questions,
-            'type_analysis': type_probabilities,
-            'diagnosis': diagnosis,
-            'detailed_results': detailed_results
-        }
-        
-        return jsonify(result)
+        with STAGE_SECONDS.time(stage='json_parse'):
+            data = request.json
+        payload, status = evaluate_responses(data.get('responses', []), data.get('test_id'))
+        with STAGE_SECONDS.time(stage='jsonify'):
+            return jsonify(payload), status
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -582,5 +1345,7 @@ def generate_diagnosis(type_probabilities):
     return diagnosis
 
 if __name__ == '__main__':
+    # Load and warm up models before accepting requests
+    init_models()
     # host='0.0.0.0' allows access from other devices on the network
     app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False)
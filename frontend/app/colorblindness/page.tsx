@@ -313,7 +313,7 @@ export default function ColorBlindnessTest() {
       const response = await fetch(`${apiUrl}/api/colorblindness/evaluate`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ responses: finalResponses }),
+        body: JSON.stringify({ test_id: testSession?.test_id, responses: finalResponses }),
       })
       if (!response.ok) throw new Error("Failed to evaluate test")
       const data = await response.json()
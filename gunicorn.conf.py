@@ -0,0 +1,95 @@
+"""
+Production pre-fork server for the Flask backend.
+
+    gunicorn -c gunicorn.conf.py
+
+Workers are forked from a master process so CPU-bound preprocessing and
+inference scale across cores. How models are shared depends on the backend:
+
+- tflite: the models are loaded and warmed once in the master before forking,
+  so every worker shares the (mmapped) weights copy-on-write.
+- keras:  TensorFlow's runtime cannot survive fork() once it has run an op, so
+  the master only imports the app and each worker loads and warms its own
+  models before it starts accepting requests.
+
+Configuration (environment variables):
+    OCULUSAI_BIND             address to listen on (default 0.0.0.0:5000)
+    OCULUSAI_WORKERS          number of worker processes (default: CPU count)
+    OCULUSAI_WORKER_THREADS   request threads per worker, so concurrent uploads
+                              can share a micro-batch (default 4)
+    OCULUSAI_MAX_REQUESTS     recycle a worker gracefully after this many
+                              requests, 0 to disable (default 1000)
+    OCULUSAI_SESSION_DB       SQLite file shared by the workers' test sessions
+                              (default with more than one worker:
+                              oculusai_sessions.db in the temp directory)
+    OCULUSAI_METRICS_DIR      directory where workers share their metrics, so
+                              /metrics reports all of them (default with more
+                              than one worker: oculusai_metrics in the temp
+                              directory; emptied when the server starts)
+    OCULUSAI_TF_INTRA_OP_THREADS / OCULUSAI_TF_INTER_OP_THREADS / OCULUSAI_TFLITE_THREADS
+                              per-worker inference threads (default: CPU count / workers)
+"""
+
+import os
+import tempfile
+
+_cpu_count = os.cpu_count() or 1
+
+bind = os.environ.get('OCULUSAI_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('OCULUSAI_WORKERS', _cpu_count))
+worker_class = 'gthread'
+threads = int(os.environ.get('OCULUSAI_WORKER_THREADS', 4))
+
+# Import the app in the master so it is shared copy-on-write
+wsgi_app = 'flask_app:app'
+preload_app = True
+
+# Graceful recycling: a worker finishes in-flight requests before it is replaced
+max_requests = int(os.environ.get('OCULUSAI_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+graceful_timeout = 30
+# Leaves room for a keras worker to load and warm its models
+timeout = 120
+
+# Split the cores between workers unless thread counts are set explicitly.
+# These are read when the app is imported, which happens after this file runs.
+_threads_per_worker = str(max(1, _cpu_count // max(1, workers)))
+os.environ.setdefault('OCULUSAI_TF_INTRA_OP_THREADS', _threads_per_worker)
+os.environ.setdefault('OCULUSAI_TF_INTER_OP_THREADS', '1')
+os.environ.setdefault('OCULUSAI_TFLITE_THREADS', _threads_per_worker)
+
+# A test may be started on one worker and answered or evaluated on another,
+# so the workers must share their test sessions
+if workers > 1:
+    os.environ.setdefault('OCULUSAI_SESSION_DB', os.path.join(tempfile.gettempdir(), 'oculusai_sessions.db'))
+    os.environ.setdefault('OCULUSAI_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'oculusai_metrics'))
+
+
+def on_starting(server):
+    from flask_app import METRICS_DIR, init_models
+    from inference import INFERENCE_BACKEND
+
+    # Processes of an earlier run are gone, and their pids may be reused
+    if METRICS_DIR:
+        for name in os.listdir(METRICS_DIR):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(METRICS_DIR, name))
+
+    if INFERENCE_BACKEND == 'tflite':
+        init_models()
+
+
+def post_fork(server, worker):
+    from flask_app import init_models
+    from inference import INFERENCE_BACKEND, configure_tf_threads
+
+    if INFERENCE_BACKEND != 'tflite':
+        configure_tf_threads()
+        init_models()
+
+
+def worker_exit(server, worker):
+    # Hand over this worker's latest counts before it is recycled
+    from flask_app import app
+
+    app.metrics.flush()
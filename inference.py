@@ -0,0 +1,245 @@
+"""
+Low-overhead inference backends for the served models.
+`model.predict` builds a data adapter and iterator on every call, which dominates
+latency for single images. Two backends avoid that and share one interface
+(call with an N×H×W×C batch, get a NumPy array back):
+
+- keras:  CompiledModel calls the Keras model through a traced tf.function with a
+          fixed input signature, optionally compiled with XLA.
+- tflite: TFLiteModel runs a post-training-quantized copy of the model (see
+          convert_tflite.py) in the TFLite interpreter.
+
+Pick one with OCULUSAI_INFERENCE_BACKEND=keras|tflite.
+
+Benchmark against model.predict:
+    python inference.py [--iterations 200] [--xla]
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, 'eye_disease_model.keras')
+ISHIHARA_MODEL_PATH = os.path.join(BASE_DIR, 'ishihara_digit_model.keras')
+IMAGE_SIZE = (256, 256)
+ISHIHARA_IMAGE_SIZE = (128, 128)
+
+# Set OCULUSAI_XLA=1 to compile the inference graphs with XLA
+USE_XLA = os.environ.get('OCULUSAI_XLA', '0') == '1'
+
+INFERENCE_BACKEND = os.environ.get('OCULUSAI_INFERENCE_BACKEND', 'keras')
+TFLITE_QUANTIZATION = os.environ.get('OCULUSAI_TFLITE_QUANTIZATION', 'int8')
+TFLITE_THREADS = int(os.environ['OCULUSAI_TFLITE_THREADS']) if os.environ.get('OCULUSAI_TFLITE_THREADS') else None
+# TFLite batches up to this size run unpadded; larger ones are padded to a power of two
+TFLITE_EXACT_BATCH_SIZE = int(os.environ.get('OCULUSAI_TFLITE_EXACT_BATCH_SIZE', 8))
+
+# TensorFlow thread pool sizes (0 lets TensorFlow decide)
+TF_INTRA_OP_THREADS = int(os.environ.get('OCULUSAI_TF_INTRA_OP_THREADS', 0))
+TF_INTER_OP_THREADS = int(os.environ.get('OCULUSAI_TF_INTER_OP_THREADS', 0))
+
+# Prefer the standalone TFLite runtime when it is installed
+try:
+    from ai_edge_litert.interpreter import Interpreter as TFLiteInterpreter
+except ImportError:
+    try:
+        from tflite_runtime.interpreter import Interpreter as TFLiteInterpreter
+    except ImportError:
+        TFLiteInterpreter = tf.lite.Interpreter
+
+
+def configure_tf_threads(intra_op=TF_INTRA_OP_THREADS, inter_op=TF_INTER_OP_THREADS):
+    """Limit TensorFlow's thread pools. Must run before TensorFlow executes its first op."""
+    if intra_op:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def softmax(logits):
+    """
+    Softmax over the last axis in NumPy.
+    Keeps TensorFlow ops out of request handling, which matters for pre-forked
+    workers: a process that has run any TensorFlow op cannot safely fork.
+    """
+    logits = np.asarray(logits, dtype=np.float32)
+    exp = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+    return exp / np.sum(exp, axis=-1, keepdims=True)
+
+
+class CompiledModel:
+    """
+    Wraps a Keras model in a tf.function specialised to one input shape.
+    The batch dimension is left open, so a single trace serves every batch size.
+    """
+
+    def __init__(self, model, input_shape, jit_compile=USE_XLA, model_path=None):
+        self.model = model
+        self.model_path = model_path
+        self.input_shape = tuple(input_shape)
+        self.jit_compile = jit_compile
+        signature = [tf.TensorSpec(shape=(None, *self.input_shape), dtype=tf.float32)]
+        self._fn = tf.function(self._forward, input_signature=signature, jit_compile=jit_compile)
+
+    def _forward(self, batch):
+        return self.model(batch, training=False)
+
+    def __call__(self, batch):
+        """Run a batch (N×H×W×C) through the model and return the outputs as a NumPy array."""
+        batch = tf.convert_to_tensor(batch, dtype=tf.float32)
+        return self._fn(batch).numpy()
+
+    def predict(self, batch, verbose=0):
+        """Drop-in replacement for keras Model.predict on in-memory batches."""
+        return self(batch)
+
+
+def padded_batch_size(batch_size, exact_up_to=TFLITE_EXACT_BATCH_SIZE):
+    """The batch size a TFLite interpreter is allocated for to run `batch_size` samples."""
+    if batch_size <= exact_up_to:
+        return max(1, batch_size)
+    return 1 << (batch_size - 1).bit_length()
+
+
+class TFLiteModel:
+    """
+    Runs a .tflite model in the TFLite interpreter.
+    Inputs and outputs stay float32; quantized tensors are (de)quantized here.
+
+    Resizing an interpreter reallocates its tensor arena, and the micro-batcher
+    produces a different batch size on almost every call. So each batch size
+    gets its own interpreter, allocated once (warmup_models() creates them
+    all). Sizes up to TFLITE_EXACT_BATCH_SIZE - every micro-batch - run as
+    they are, since padding costs more compute than it saves; larger batches
+    are zero-padded to the next power of two to bound the number of arenas.
+    An interpreter is not thread-safe, so calls of the same size are serialised.
+    """
+
+    def __init__(self, model_path, input_shape, num_threads=TFLITE_THREADS):
+        self.model_path = model_path
+        self.input_shape = tuple(input_shape)
+        self.num_threads = num_threads
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        # Fail at load time, not on the first request, if the model is unusable
+        self._interpreter_for(1)
+
+    def _interpreter_for(self, batch_size):
+        """(interpreter, input details, output details, lock) allocated for `batch_size` samples."""
+        with self._lock:
+            entry = self._interpreters.get(batch_size)
+            if entry is None:
+                interpreter = TFLiteInterpreter(model_path=self.model_path, num_threads=self.num_threads)
+                input_index = interpreter.get_input_details()[0]['index']
+                interpreter.resize_tensor_input(input_index, [batch_size, *self.input_shape])
+                interpreter.allocate_tensors()
+                entry = (interpreter, interpreter.get_input_details()[0],
+                         interpreter.get_output_details()[0], threading.Lock())
+                self._interpreters[batch_size] = entry
+            return entry
+
+    def __call__(self, batch):
+        """Run a batch (N×H×W×C) through the model and return the outputs as a NumPy array."""
+        batch = np.asarray(batch, dtype=np.float32)
+        count = len(batch)
+        padded_size = padded_batch_size(count)
+        interpreter, input_details, output_details, lock = self._interpreter_for(padded_size)
+
+        scale, zero_point = input_details['quantization']
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+            info = np.iinfo(input_details['dtype'])
+            batch = np.clip(batch, info.min, info.max)
+        padded = np.zeros((padded_size, *self.input_shape), dtype=input_details['dtype'])
+        padded[:count] = batch
+
+        with lock:
+            interpreter.set_tensor(input_details['index'], padded)
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_details['index'])[:count]
+
+        scale, zero_point = output_details['quantization']
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output.copy()
+
+    def predict(self, batch, verbose=0):
+        """Drop-in replacement for keras Model.predict on in-memory batches."""
+        return self(batch)
+
+
+def tflite_model_path(model_path, quantization=TFLITE_QUANTIZATION):
+    """Path of the quantized copy of a Keras model, e.g. model.int8.tflite."""
+    return f"{os.path.splitext(model_path)[0]}.{quantization}.tflite"
+
+
+def load_inference_model(model_path, input_shape, backend=INFERENCE_BACKEND):
+    """Load a Keras model file for serving with the chosen backend ('keras' or 'tflite')."""
+    if backend == 'keras':
+        model = tf.keras.models.load_model(model_path)
+        return CompiledModel(model, input_shape, model_path=model_path)
+    if backend == 'tflite':
+        return TFLiteModel(tflite_model_path(model_path), input_shape)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def time_calls(fn, batch, iterations):
+    """Return per-call latencies in milliseconds after one untimed warmup call."""
+    fn(batch)
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(batch)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def benchmark(model, input_shape, iterations=200, batch_sizes=(1, 8), jit_compile=USE_XLA):
+    """Compare model.predict with CompiledModel at each batch size."""
+    compiled = CompiledModel(model, input_shape, jit_compile=jit_compile)
+    results = []
+    for batch_size in batch_sizes:
+        batch = np.random.rand(batch_size, *input_shape).astype(np.float32)
+        np.testing.assert_allclose(compiled(batch), model.predict(batch, verbose=0), rtol=1e-4, atol=1e-5)
+
+        baseline = time_calls(lambda x: model.predict(x, verbose=0), batch, iterations)
+        fast = time_calls(compiled, batch, iterations)
+        results.append({
+            'batch_size': batch_size,
+            'predict_p50_ms': float(np.percentile(baseline, 50)),
+            'predict_p99_ms': float(np.percentile(baseline, 99)),
+            'compiled_p50_ms': float(np.percentile(fast, 50)),
+            'compiled_p99_ms': float(np.percentile(fast, 99)),
+            'speedup': float(np.median(baseline) / np.median(fast))
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CompiledModel against keras model.predict.')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed calls per configuration')
+    parser.add_argument('--xla', action='store_true', default=USE_XLA, help='Compile the tf.function with XLA')
+    args = parser.parse_args()
+
+    models = [
+        ('Eye disease', MODEL_PATH, (*IMAGE_SIZE, 3)),
+        ('Ishihara digit', ISHIHARA_MODEL_PATH, (*ISHIHARA_IMAGE_SIZE, 3))
+    ]
+    for name, path, input_shape in models:
+        if not os.path.exists(path):
+            print(f"Skipping {name} model: {path} not found")
+            continue
+        model = tf.keras.models.load_model(path)
+        print(f"\n{name} model ({'XLA' if args.xla else 'no XLA'}, {args.iterations} calls)")
+        for r in benchmark(model, input_shape, args.iterations, jit_compile=args.xla):
+            print(f"  batch {r['batch_size']:>2}: model.predict p50 {r['predict_p50_ms']:.2f} ms "
+                  f"(p99 {r['predict_p99_ms']:.2f}) | compiled p50 {r['compiled_p50_ms']:.2f} ms "
+                  f"(p99 {r['compiled_p99_ms']:.2f}) | {r['speedup']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Precomputed ground-truth digit index for the Ishihara plate set.
+The Ishihara CNN's answer for a given plate never changes, so every plate in
+CBTestImages is classified once and the results are persisted next to the model.
+Entries are only recomputed when the model file or a plate changes.
+
+Usage:
+    python ishihara_index.py            # build or refresh the index
+    python ishihara_index.py --rebuild  # force a full rebuild
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+INDEX_VERSION = 1
+ISHIHARA_IMAGE_SIZE = (128, 128)
+INDEX_BATCH_SIZE = 64
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = os.path.join(BASE_DIR, 'ishihara_digit_model.keras')
+DEFAULT_DATA_DIR = os.path.join(BASE_DIR, 'CBTestImages')
+
+
+def default_index_path(model_path):
+    """The index lives next to the model it was computed with."""
+    return os.path.splitext(model_path)[0] + '.index.json'
+
+
+def default_report_path(model_path):
+    """The evaluation report written by train_ishihara_model.py lives next to the model too."""
+    return os.path.splitext(model_path)[0] + '.eval.json'
+
+
+def load_report(report_path):
+    """Load a model evaluation report, or return None if it is missing or unreadable."""
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_plate_pixels(image_path):
+    """Decode an Ishihara plate and resize it to the model input, as uint8 RGB."""
+    image = Image.open(image_path).convert('RGB')
+    img_resized = image.resize(ISHIHARA_IMAGE_SIZE)
+    return np.asarray(img_resized, dtype=np.uint8)
+
+
+def load_plate(image_path):
+    """Load an Ishihara plate and preprocess it for the digit model."""
+    return read_plate_pixels(image_path) / 255.0
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Return a {size, mtime_ns, sha256} fingerprint for `path`.
+    The hash is reused from `previous` when size and mtime are unchanged,
+    so an unchanged file is never re-read.
+    """
+    stat = os.stat(path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        sha256 = previous['sha256']
+    else:
+        sha256 = file_sha256(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+
+
+def load_index(index_path):
+    """Load a persisted index, or return None if it is missing or unreadable."""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def save_index(index, index_path):
+    """Write the index atomically so a crash never leaves a truncated file."""
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+def save_report(report, report_path):
+    """Write an evaluation report atomically (indented, as it is meant to be read)."""
+    tmp_path = f"{report_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_path)
+
+
+def predict_plates(model, image_paths, batch_size=INDEX_BATCH_SIZE, plate_store=None):
+    """
+    Run the digit model over plates in batches, reading them from `plate_store`
+    (see plate_store.py) where possible instead of decoding the PNGs.
+    Returns (digits, probabilities) with probabilities computed exactly as the API does.
+    """
+    from inference import softmax
+
+    digits = []
+    probabilities = []
+    for start in range(0, len(image_paths), batch_size):
+        paths = image_paths[start:start + batch_size]
+        filenames = [os.path.basename(path) for path in paths]
+        if plate_store is not None and all(filename in plate_store for filename in filenames):
+            batch = plate_store.images(filenames)
+        else:
+            batch = np.stack([load_plate(path) for path in paths])
+        predictions = model.predict(batch, verbose=0)
+        digits.extend(int(d) for d in np.argmax(predictions, axis=1))
+        probabilities.extend(softmax(predictions).tolist())
+    return digits, probabilities
+
+
+def update_index(model, model_path, data_dir, index_path=None, rebuild=False, plate_store=None):
+    """
+    Bring the persisted index up to date and return it.
+
+    The whole index is rebuilt when the model file changes; otherwise only plates
+    that are new or whose content hash changed are re-classified.
+    """
+    index_path = index_path or default_index_path(model_path)
+    index = None if rebuild else load_index(index_path)
+
+    previous_model = index['model'] if index else None
+    model_print = file_fingerprint(model_path, previous_model)
+    if index is None or previous_model['sha256'] != model_print['sha256']:
+        index = {'version': INDEX_VERSION, 'model': model_print, 'plates': {}}
+    changed = index['model'] != model_print
+    index['model'] = model_print
+
+    filenames = sorted(f for f in os.listdir(data_dir) if f.endswith('.png'))
+    plates = {}
+    stale = []
+    for filename in filenames:
+        previous = index['plates'].get(filename)
+        plate_print = file_fingerprint(os.path.join(data_dir, filename), previous)
+        if previous is not None and previous['sha256'] == plate_print['sha256']:
+            changed = changed or any(previous[k] != plate_print[k] for k in plate_print)
+            plates[filename] = {**previous, **plate_print}
+        else:
+            plates[filename] = plate_print
+            stale.append(filename)
+
+    changed = changed or bool(stale) or len(plates) != len(index['plates'])
+    if stale:
+        print(f"Classifying {len(stale)} Ishihara plates...")
+        digits, probabilities = predict_plates(
+            model, [os.path.join(data_dir, f) for f in stale], plate_store=plate_store)
+        for filename, digit, probs in zip(stale, digits, probabilities):
+            plates[filename]['digit'] = digit
+            plates[filename]['probabilities'] = probs
+
+    index['plates'] = plates
+    if changed:
+        save_index(index, index_path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the Ishihara ground-truth digit index.')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='Path to the Ishihara digit model')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Directory of Ishihara plates')
+    parser.add_argument('--index', default=None, help='Output index path (default: next to the model)')
+    parser.add_argument('--rebuild', action='store_true', help='Ignore any existing index and rebuild it')
+    args = parser.parse_args()
+
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(args.model)
+    index_path = args.index or default_index_path(args.model)
+    index = update_index(model, args.model, args.data_dir, index_path, rebuild=args.rebuild)
+    print(f"✓ Indexed {len(index['plates'])} plates → {index_path}")
+
+
+if __name__ == '__main__':
+    main()
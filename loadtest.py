@@ -0,0 +1,364 @@
+"""
+Load-test harness for the OculusAI API.
+
+Drives the real endpoints with concurrent simulated clients and writes a JSON
+report (throughput, error rate and p50/p95/p99 latency per endpoint) that can
+be diffed across commits.
+
+Scenarios:
+    predict  - POST images from Sample_Retinal_Images to /api/predict
+    session  - a full Ishihara test: start-test, fetch every plate, evaluate
+               (with --adaptive: one plate at a time through /answer until the test stops)
+    mixed    - both, weighted by --predict-weight
+
+Usage:
+    python loadtest.py --in-process --duration 30 --concurrency 8
+    python loadtest.py --url http://localhost:5000 --scenario session --output report.json
+
+Runs are reproducible for a given --seed (images, plate answers and scenario
+choices are drawn from per-client seeded generators). Each upload gets a few
+random trailing bytes, which decoders ignore, so it misses the server's
+prediction cache and the predict numbers measure decode and inference;
+--repeat-uploads sends the sample files unchanged to measure cache hits instead.
+
+A request counts as an error if it raises or returns a 5xx; 4xx responses
+(e.g. retinal-validation rejections) are counted per status code but are not
+errors.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from plate_manifest import parse_ishihara_filename
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_RETINAL_DIR = os.path.join(BASE_DIR, 'Sample_Retinal_Images')
+
+
+class HTTPTransport:
+    """Sends requests to a running server over one keep-alive connection per client thread."""
+
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def request(self, method, path, body=None, headers=None):
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            # Start over on a fresh connection next time
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+class InProcessTransport:
+    """Calls the Flask app through its test client, with no network in between."""
+
+    def __init__(self):
+        import flask_app
+        if not flask_app.app.ready.is_set():
+            flask_app.init_models()
+        self.app = flask_app.app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, headers=headers or {})
+        return response.status_code, response.get_data()
+
+
+def multipart_body(field, filename, data):
+    """Encode a single file upload as multipart/form-data; returns (body, content_type)."""
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def load_sample_images(data_dir=SAMPLE_RETINAL_DIR):
+    images = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(data_dir, filename), 'rb') as f:
+                images.append((filename, f.read()))
+    return images
+
+
+class LoadTest:
+    """Runs simulated clients against a transport and collects per-request latencies."""
+
+    def __init__(self, transport, images, scenario='mixed', predict_weight=0.5,
+                 session_plates=20, answer_accuracy=0.9, seed=42, adaptive=False, unique_uploads=True):
+        self.transport = transport
+        self.images = images
+        self.scenario = scenario
+        self.predict_weight = predict_weight
+        self.session_plates = session_plates
+        self.answer_accuracy = answer_accuracy
+        self.seed = seed
+        self.adaptive = adaptive
+        self.unique_uploads = unique_uploads
+        self._lock = threading.Lock()
+        self._recording = False
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = defaultdict(list)
+            self.statuses = defaultdict(lambda: defaultdict(int))
+            self.errors = defaultdict(int)
+            self.session_latencies = []
+            self.session_plates_shown = []
+
+    def _call(self, name, method, path, body=None, headers=None):
+        start = time.perf_counter()
+        try:
+            status, data = self.transport.request(method, path, body, headers)
+        except Exception:
+            status, data = None, None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if self._recording:
+            with self._lock:
+                self.latencies[name].append(elapsed_ms)
+                self.statuses[name]['exception' if status is None else str(status)] += 1
+                if status is None or status >= 500:
+                    self.errors[name] += 1
+        return status, data
+
+    def run_predict(self, rng):
+        filename, data = self.images[rng.randrange(len(self.images))]
+        if self.unique_uploads:
+            # Trailing bytes after the end of the image change its cache key, not its pixels.
+            # Not drawn from rng: the warmup replays the same per-client sequences
+            data += uuid.uuid4().bytes
+        body, content_type = multipart_body('image', filename, data)
+        self._call('predict', 'POST', '/api/predict', body, {'Content-Type': content_type})
+
+    def run_session(self, rng):
+        start = time.perf_counter()
+        status, data = self._call('start_test', 'GET', f'/api/colorblindness/start-test?count={self.session_plates}')
+        if status != 200:
+            return
+        session = json.loads(data)
+        plates = session['images']
+
+        for plate in plates:
+            self._call('plate_image', 'GET', f"/api/colorblindness/image/{quote(plate['filename'])}")
+
+        responses = [
+            {'filename': plate['filename'], 'user_answer': self.answer(rng, plate['filename'])}
+            for plate in plates
+        ]
+        body = json.dumps({'test_id': session['test_id'], 'responses': responses}).encode()
+        status, _ = self._call('evaluate', 'POST', '/api/colorblindness/evaluate', body,
+                               {'Content-Type': 'application/json'})
+        if status == 200 and self._recording:
+            with self._lock:
+                self.session_latencies.append((time.perf_counter() - start) * 1000)
+                self.session_plates_shown.append(len(plates))
+
+    def answer(self, rng, filename):
+        """A mostly-correct viewer: the digit in the plate's filename with probability answer_accuracy."""
+        digit = parse_ishihara_filename(filename)['digit']
+        return digit if rng.random() < self.answer_accuracy else rng.randrange(10)
+
+    def run_adaptive_session(self, rng):
+        start = time.perf_counter()
+        status, data = self._call('start_test', 'GET',
+                                  f'/api/colorblindness/start-test?adaptive=true&count={self.session_plates}')
+        if status != 200:
+            return
+        session = json.loads(data)
+        plate = session['images'][0]
+
+        responses = []
+        while plate is not None:
+            self._call('plate_image', 'GET', f"/api/colorblindness/image/{quote(plate['filename'])}")
+            responses.append({'filename': plate['filename'], 'user_answer': self.answer(rng, plate['filename'])})
+            body = json.dumps({'test_id': session['test_id'], **responses[-1]}).encode()
+            status, data = self._call('answer', 'POST', '/api/colorblindness/answer', body,
+                                      {'Content-Type': 'application/json'})
+            if status != 200:
+                return
+            plate = json.loads(data)['next_image']
+
+        body = json.dumps({'test_id': session['test_id'], 'responses': responses}).encode()
+        status, _ = self._call('evaluate', 'POST', '/api/colorblindness/evaluate', body,
+                               {'Content-Type': 'application/json'})
+        if status == 200 and self._recording:
+            with self._lock:
+                self.session_latencies.append((time.perf_counter() - start) * 1000)
+                self.session_plates_shown.append(len(responses))
+
+    def _client(self, index, deadline):
+        rng = random.Random(self.seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            if self.scenario == 'predict' or (self.scenario == 'mixed' and rng.random() < self.predict_weight):
+                self.run_predict(rng)
+            elif self.adaptive:
+                self.run_adaptive_session(rng)
+            else:
+                self.run_session(rng)
+
+    def _run_clients(self, concurrency, seconds):
+        deadline = time.perf_counter() + seconds
+        threads = [threading.Thread(target=self._client, args=(i, deadline)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run(self, concurrency, duration, warmup=0.0):
+        """Warm up (unrecorded), then drive `concurrency` clients for `duration` seconds."""
+        if warmup > 0:
+            self._run_clients(concurrency, warmup)
+        self.reset()
+        self._recording = True
+        start = time.perf_counter()
+        self._run_clients(concurrency, duration)
+        elapsed = time.perf_counter() - start
+        self._recording = False
+        return elapsed
+
+
+def latency_summary(latencies_ms):
+    if not latencies_ms:
+        return None
+    values = np.asarray(latencies_ms)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'p50': round(float(p50), 2),
+        'p95': round(float(p95), 2),
+        'p99': round(float(p99), 2),
+        'mean': round(float(values.mean()), 2),
+        'max': round(float(values.max()), 2)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(test, elapsed, config):
+    endpoints = {}
+    for name, latencies in sorted(test.latencies.items()):
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': test.errors[name],
+            'error_rate': round(test.errors[name] / len(latencies), 4),
+            'rps': round(len(latencies) / elapsed, 2),
+            'latency_ms': latency_summary(latencies),
+            'status_counts': dict(test.statuses[name])
+        }
+
+    all_latencies = [ms for latencies in test.latencies.values() for ms in latencies]
+    total_errors = sum(test.errors.values())
+    return {
+        'commit': git_commit(),
+        'started_at': config.pop('started_at'),
+        'config': config,
+        'elapsed_seconds': round(elapsed, 2),
+        'total': {
+            'requests': len(all_latencies),
+            'errors': total_errors,
+            'error_rate': round(total_errors / len(all_latencies), 4) if all_latencies else 0.0,
+            'rps': round(len(all_latencies) / elapsed, 2),
+            'latency_ms': latency_summary(all_latencies)
+        },
+        'endpoints': endpoints,
+        'sessions': {
+            'completed': len(test.session_latencies),
+            'per_second': round(len(test.session_latencies) / elapsed, 2),
+            'latency_ms': latency_summary(test.session_latencies),
+            'mean_plates': round(float(np.mean(test.session_plates_shown)), 2) if test.session_plates_shown else None
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the OculusAI API and report latency percentiles as JSON.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', default='http://localhost:5000', help='Base URL of a running server')
+    target.add_argument('--in-process', action='store_true', help='Drive flask_app directly through its test client')
+    parser.add_argument('--scenario', choices=['predict', 'session', 'mixed'], default='mixed')
+    parser.add_argument('--concurrency', type=int, default=8, help='Simultaneous simulated clients')
+    parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Unmeasured seconds before the run')
+    parser.add_argument('--predict-weight', type=float, default=0.5, help='Share of predict iterations in the mixed scenario')
+    parser.add_argument('--session-plates', type=int, default=20, help='Plates per Ishihara session (the most shown, with --adaptive)')
+    parser.add_argument('--adaptive', action='store_true', help='Run Ishihara sessions as adaptive tests that stop early')
+    parser.add_argument('--repeat-uploads', action='store_true',
+                        help='Upload the sample images unchanged, so repeats hit the prediction cache')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+    args = parser.parse_args()
+
+    transport = InProcessTransport() if args.in_process else HTTPTransport(args.url)
+    test = LoadTest(transport, load_sample_images(), args.scenario, args.predict_weight,
+                    args.session_plates, seed=args.seed, adaptive=args.adaptive,
+                    unique_uploads=not args.repeat_uploads)
+
+    config = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'target': 'in-process' if args.in_process else args.url,
+        'scenario': args.scenario,
+        'concurrency': args.concurrency,
+        'duration_seconds': args.duration,
+        'warmup_seconds': args.warmup,
+        'predict_weight': args.predict_weight,
+        'session_plates': args.session_plates,
+        'adaptive': args.adaptive,
+        'unique_uploads': not args.repeat_uploads,
+        'seed': args.seed
+    }
+    print(f"Running {args.scenario} load test against {config['target']} "
+          f"({args.concurrency} clients, {args.duration:g}s)...", flush=True)
+    elapsed = test.run(args.concurrency, args.duration, args.warmup)
+    report = build_report(test, elapsed, config)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        total = report['total']
+        print(f"✓ {total['requests']} requests, {total['rps']} req/s, error rate {total['error_rate']:.2%}, "
+              f"p99 {total['latency_ms']['p99'] if total['latency_ms'] else '-'} ms → {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+Recording a value is a perf_counter call, a bisect and a locked increment, so
+instrumentation can stay on in production.
+
+Each process records into its own memory. With a `multiprocess_dir` (set under
+gunicorn), every process also writes its values to a file there about once a
+second, and a scrape answered by any worker merges all of them: counters and
+histograms are summed (a recycled worker's totals are folded into a shared
+file, so they never go backwards), and gauges are combined over the live
+processes. The series carry no per-process labels, so recycling workers does
+not create new series.
+"""
+
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans sub-millisecond array ops up to slow multi-image requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# How often each process writes its values to the multiprocess directory
+FLUSH_INTERVAL = 1.0
+# Counters and histograms of processes that have exited, merged together
+DEAD_PROCESSES_FILE = 'dead.json'
+
+# How a gauge is combined across live processes
+GAUGE_MODES = ('sum', 'min', 'max')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{str(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if not isinstance(value, int) else str(value)
+
+
+class _Metric:
+    multiprocess_mode = 'sum'
+
+    def __init__(self, name, documentation, labelnames=(), on_record=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._on_record = on_record
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if self._on_record is not None:
+            self._on_record()
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def _reset(self):
+        # After fork(): the child starts from zero, its parent keeps reporting its own values
+        self._lock = threading.Lock()
+        self._values = {}
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. requests served."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, e.g. requests in flight.
+    `multiprocess_mode` says how values from several processes are combined.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), on_record=None, multiprocess_mode='sum'):
+        super().__init__(name, documentation, labelnames, on_record)
+        if multiprocess_mode not in GAUGE_MODES:
+            raise ValueError(f"Unknown gauge multiprocess mode: {multiprocess_mode}")
+        self.multiprocess_mode = multiprocess_mode
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, plus their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, on_record=None):
+        super().__init__(name, documentation, labelnames, on_record)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in values.items():
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', repr(bound)),), cumulative
+            cumulative += counts[-1]
+            yield f'{self.name}_bucket', labels + (('le', '+Inf'),), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _combine(mode, current, value):
+    if current is None:
+        return value
+    if mode == 'min':
+        return min(current, value)
+    if mode == 'max':
+        return max(current, value)
+    return current + value
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and renders them in the Prometheus text format.
+    Values that already live elsewhere (queue depth, cache counters) are read at
+    scrape time from callbacks registered with `register_callback`.
+
+    With `multiprocess_dir`, render() reports the values of every process
+    writing to that directory (see the module docstring).
+    """
+
+    def __init__(self, multiprocess_dir=None):
+        self.multiprocess_dir = multiprocess_dir
+        self._metrics = []
+        self._callbacks = []
+        self._flusher = None
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _add(self, metric):
+        if self.multiprocess_dir:
+            metric._on_record = self._ensure_flusher
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        return self._add(Gauge(name, documentation, labelnames, multiprocess_mode=multiprocess_mode))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_callback(self, callback):
+        """
+        `callback()` returns a list of (name, type, documentation, value) tuples,
+        with an optional fifth element giving a gauge's multiprocess mode;
+        it is called on every scrape.
+        """
+        self._callbacks.append(callback)
+
+    def _after_fork(self):
+        for metric in self._metrics:
+            metric._reset()
+        self._flusher = None
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def collect(self):
+        """
+        This process's values as a list of families:
+        (name, type, documentation, multiprocess mode, [(sample name, labels, value)]).
+        """
+        families = []
+        for metric in self._metrics:
+            families.append((metric.name, metric.type, metric.documentation, metric.multiprocess_mode,
+                             list(metric.samples())))
+        for callback in self._callbacks:
+            try:
+                collected = callback()
+            except Exception as e:
+                print(f"❌ Error collecting metrics: {str(e)}")
+                continue
+            for name, metric_type, documentation, value, *mode in collected:
+                families.append((name, metric_type, documentation, mode[0] if mode else 'sum',
+                                 [(name, (), value)]))
+        return families
+
+    def _path(self, name):
+        return os.path.join(self.multiprocess_dir, name)
+
+    def flush(self):
+        """Write this process's values to the multiprocess directory."""
+        if not self.multiprocess_dir:
+            return
+        pid = os.getpid()
+        path = self._path(f'{pid}.json')
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'pid': pid, 'families': self.collect()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"❌ Error writing metrics: {str(e)}")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _merge(merged, families, include_gauges=True):
+        for name, metric_type, documentation, mode, samples in families:
+            if metric_type == 'gauge' and not include_gauges:
+                continue
+            family = merged.setdefault(name, (metric_type, documentation, mode, {}))
+            values = family[3]
+            for sample_name, labels, value in samples:
+                key = (sample_name, tuple(tuple(pair) for pair in labels))
+                values[key] = _combine(mode if metric_type == 'gauge' else 'sum', values.get(key), value)
+
+    @staticmethod
+    def _unmerge(merged):
+        return [
+            (name, metric_type, documentation, mode, [(key[0], key[1], value) for key, value in values.items()])
+            for name, (metric_type, documentation, mode, values) in merged.items()
+        ]
+
+    def _fold_dead_processes(self):
+        """Merge the counters and histograms of exited processes into DEAD_PROCESSES_FILE (lock held)."""
+        dead_paths = []
+        for path in glob.glob(self._path('[0-9]*.json')):
+            pid = int(os.path.basename(path).split('.')[0])
+            if not _pid_alive(pid):
+                dead_paths.append(path)
+        if not dead_paths:
+            return
+
+        merged = {}
+        previous = self._read(self._path(DEAD_PROCESSES_FILE))
+        if previous is not None:
+            self._merge(merged, previous['families'])
+        for path in dead_paths:
+            snapshot = self._read(path)
+            if snapshot is not None:
+                self._merge(merged, snapshot['families'], include_gauges=False)
+        tmp_path = self._path(f'{DEAD_PROCESSES_FILE}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pid': None, 'families': self._unmerge(merged)}, f)
+        os.replace(tmp_path, self._path(DEAD_PROCESSES_FILE))
+        for path in dead_paths:
+            os.remove(path)
+
+    def _families(self):
+        """Families to render: this process's own, or every process's merged."""
+        own = self.collect()
+        if not self.multiprocess_dir:
+            return own
+
+        import fcntl
+
+        merged = {}
+        self._merge(merged, own)
+        own_path = self._path(f'{os.getpid()}.json')
+        # Held while reading too, so a file being folded is never counted twice
+        with open(self._path('.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._fold_dead_processes()
+            except OSError as e:
+                print(f"❌ Error merging metrics of exited workers: {str(e)}")
+            for path in glob.glob(self._path('*.json')):
+                if path == own_path:
+                    continue
+                snapshot = self._read(path)
+                if snapshot is not None:
+                    self._merge(merged, snapshot['families'])
+        return self._unmerge(merged)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, metric_type, documentation, _, samples in self._families():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,150 @@
+"""
+In-memory store of the Ishihara plate PNGs served to the test frontend.
+Plate files never change while the app runs, so their bytes are read once
+(~55 MB for the full set; shared copy-on-write by pre-forked workers) along
+with a strong ETag, and responses can be sent without touching the disk and
+revalidated with a 304.
+
+Benchmark against the original send_file handler:
+    python plate_cache.py [--requests 5000]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+PlateFile = namedtuple('PlateFile', ['data', 'etag'])
+
+# Plates are immutable for the lifetime of a deployment
+PLATE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class PlateImageCache:
+    """
+    Filename → PlateFile(data, etag) for the PNGs in a plate directory.
+
+    With `preload`, every plate is read up front; otherwise plates are read on
+    first request. A plate added later is picked up on its first request, and
+    `reload()` rereads the whole directory.
+    """
+
+    def __init__(self, data_dir, preload=True):
+        self.data_dir = data_dir
+        self._files = {}
+        self._lock = threading.Lock()
+        if preload:
+            self.reload()
+
+    def _read(self, filename):
+        with open(os.path.join(self.data_dir, filename), 'rb') as f:
+            data = f.read()
+        return PlateFile(data, f'"{hashlib.sha256(data).hexdigest()[:32]}"')
+
+    def reload(self):
+        """Read every plate in the directory and swap in the new set."""
+        try:
+            filenames = [f for f in os.listdir(self.data_dir) if f.endswith('.png')]
+        except OSError:
+            filenames = []
+        files = {filename: self._read(filename) for filename in filenames}
+        with self._lock:
+            self._files = files
+
+    def get(self, filename):
+        """Return the PlateFile for `filename`, or None if there is no such plate."""
+        plate = self._files.get(filename)
+        if plate is not None:
+            return plate
+
+        # Only plain filenames inside the plate directory are ever read
+        if os.path.basename(filename) != filename or not filename.endswith('.png'):
+            return None
+        try:
+            plate = self._read(filename)
+        except OSError:
+            return None
+        with self._lock:
+            self._files[filename] = plate
+        return plate
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def nbytes(self):
+        return sum(len(plate.data) for plate in self._files.values())
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value matches `etag` (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(','))
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+def plate_headers(etag):
+    return {'ETag': etag, 'Cache-Control': PLATE_CACHE_CONTROL}
+
+
+def requests_per_second(client, urls, headers=None):
+    start = time.perf_counter()
+    for url in urls:
+        response = client.get(url, headers=headers or {})
+        response.close()
+    return len(urls) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark in-memory plate serving against send_file.')
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CBTestImages'))
+    parser.add_argument('--requests', type=int, default=5000, help='Requests per configuration')
+    args = parser.parse_args()
+
+    from flask import Flask, Response, jsonify, request, send_file
+
+    start = time.perf_counter()
+    cache = PlateImageCache(args.data_dir)
+    print(f"Loaded {len(cache)} plates ({cache.nbytes / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
+
+    app = Flask(__name__)
+
+    # The handler as it was before plates were cached
+    @app.route('/disk/<path:filename>')
+    def disk(filename):
+        image_path = os.path.join(args.data_dir, filename)
+        if not os.path.exists(image_path):
+            return jsonify({'error': 'Image not found'}), 404
+        return send_file(image_path, mimetype='image/png')
+
+    @app.route('/memory/<path:filename>')
+    def memory(filename):
+        plate = cache.get(filename)
+        if plate is None:
+            return jsonify({'error': 'Image not found'}), 404
+        if etag_matches(request.headers.get('If-None-Match'), plate.etag):
+            return Response(status=304, headers=plate_headers(plate.etag))
+        return Response(plate.data, mimetype='image/png', headers=plate_headers(plate.etag))
+
+    filenames = sorted(cache._files)
+    picks = [random.choice(filenames) for _ in range(args.requests)]
+    client = app.test_client()
+
+    disk_rps = requests_per_second(client, [f'/disk/{f}' for f in picks])
+    memory_rps = requests_per_second(client, [f'/memory/{f}' for f in picks])
+    etag = cache.get(picks[0]).etag
+    revalidate_rps = requests_per_second(client, [f'/memory/{picks[0]}'] * args.requests, {'If-None-Match': etag})
+
+    print(f"send_file from disk: {disk_rps:,.0f} req/s")
+    print(f"in-memory:           {memory_rps:,.0f} req/s ({memory_rps / disk_rps:.1f}x)")
+    print(f"304 revalidation:    {revalidate_rps:,.0f} req/s ({revalidate_rps / disk_rps:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+In-memory manifest of the Ishihara plate set.
+The plate directory is scanned and parsed once; digit, font and colour type are
+kept in columnar NumPy arrays so a test session can be sampled without touching
+the filesystem or re-running the filename regex.
+"""
+
+import os
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+_Columns = namedtuple('_Columns', ['filenames', 'digits', 'font_codes', 'font_names', 'types', 'by_type', 'rows'])
+
+
+def parse_ishihara_filename(filename):
+    """Parse Ishihara image filename to extract digit, font, and color type."""
+    match = re.match(r'(\d)_(.+?)theme_\d+ type_(\d)', filename)
+    if match:
+        return {
+            'digit': int(match.group(1)),
+            'font': match.group(2),
+            'type': int(match.group(3))
+        }
+    return None
+
+
+def _allocate(count, capacities, rng):
+    """
+    Split `count` picks as evenly as possible across groups with the given capacities.
+    Leftover picks from the even split go to randomly chosen groups that still have room.
+    """
+    quotas = {key: 0 for key in capacities}
+    remaining = count
+    while remaining > 0:
+        open_groups = [key for key in capacities if quotas[key] < capacities[key]]
+        if not open_groups:
+            break
+        share = remaining // len(open_groups)
+        if share == 0:
+            for key in rng.sample(open_groups, remaining):
+                quotas[key] += 1
+            break
+        for key in open_groups:
+            take = min(share, capacities[key] - quotas[key])
+            quotas[key] += take
+            remaining -= take
+    return quotas
+
+
+class PlateManifest:
+    """
+    Columnar index of the plates in an Ishihara data directory.
+
+    Call `refresh_if_changed()` before reading to pick up added or removed plates
+    (the directory mtime is polled at most every `watch_interval` seconds), or
+    `reload()` to force a rescan.
+    """
+
+    def __init__(self, data_dir, watch_interval=5.0):
+        self.data_dir = data_dir
+        self.watch_interval = watch_interval
+        self._lock = threading.Lock()
+        self._dir_mtime_ns = None
+        self._last_check = 0.0
+        self._columns = None
+        self.reload()
+
+    def _scan(self):
+        try:
+            dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+            all_files = sorted(f for f in os.listdir(self.data_dir) if f.endswith('.png'))
+        except OSError:
+            dir_mtime_ns, all_files = None, []
+
+        filenames, digits, fonts, types = [], [], [], []
+        for filename in all_files:
+            parsed = parse_ishihara_filename(filename)
+            if parsed:
+                filenames.append(filename)
+                digits.append(parsed['digit'])
+                fonts.append(parsed['font'])
+                types.append(parsed['type'])
+
+        font_names, font_codes = np.unique(np.array(fonts, dtype=str), return_inverse=True)
+        types = np.array(types, dtype=np.int8)
+        columns = _Columns(
+            filenames=np.array(filenames, dtype=object),
+            digits=np.array(digits, dtype=np.int8),
+            font_codes=font_codes.astype(np.int16),
+            font_names=font_names.tolist(),
+            types=types,
+            by_type={int(t): np.flatnonzero(types == t) for t in np.unique(types)},
+            rows={filename: i for i, filename in enumerate(filenames)}
+        )
+        return dir_mtime_ns, columns
+
+    def reload(self):
+        """Rescan the plate directory and swap in the new columns."""
+        dir_mtime_ns, columns = self._scan()
+        with self._lock:
+            self._columns = columns
+            self._dir_mtime_ns = dir_mtime_ns
+            self._last_check = time.monotonic()
+
+    def refresh_if_changed(self):
+        """Reload if plates were added or removed since the last scan."""
+        now = time.monotonic()
+        if now - self._last_check < self.watch_interval:
+            return False
+        self._last_check = now
+        try:
+            dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+        except OSError:
+            dir_mtime_ns = None
+        if dir_mtime_ns == self._dir_mtime_ns:
+            return False
+        self.reload()
+        return True
+
+    def __len__(self):
+        return len(self._columns.filenames)
+
+    def __contains__(self, filename):
+        return filename in self._columns.rows
+
+    def plate(self, index, columns=None):
+        """Return plate `index` as a {filename, digit, font, type} dict."""
+        columns = columns or self._columns
+        return {
+            'filename': columns.filenames[index],
+            'digit': int(columns.digits[index]),
+            'font': columns.font_names[columns.font_codes[index]],
+            'type': int(columns.types[index])
+        }
+
+    def lookup(self, filename):
+        """Return the parsed plate for `filename`, or None if it is not in the manifest."""
+        columns = self._columns
+        index = columns.rows.get(filename)
+        return None if index is None else self.plate(index, columns)
+
+    def sample(self, count, stratify=True, rng=None):
+        """
+        Randomly select up to `count` distinct plates in O(count).
+        With `stratify`, the selection is spread evenly across the colour types present.
+        """
+        rng = rng or random
+        columns = self._columns
+        count = min(count, len(columns.filenames))
+
+        if not stratify:
+            picks = rng.sample(range(len(columns.filenames)), count)
+        else:
+            quotas = _allocate(count, {t: len(idx) for t, idx in columns.by_type.items()}, rng)
+            picks = []
+            for plate_type, quota in quotas.items():
+                indices = columns.by_type[plate_type]
+                picks.extend(int(indices[i]) for i in rng.sample(range(len(indices)), quota))
+            rng.shuffle(picks)
+
+        return [self.plate(i, columns) for i in picks]
+
+    def plate_types(self):
+        """Colour types present in the plate set."""
+        return sorted(self._columns.by_type)
+
+    def sample_type(self, plate_type, exclude=(), rng=None):
+        """
+        Randomly select one plate of `plate_type` whose filename is not in `exclude`,
+        or None if there is none left.
+        """
+        rng = rng or random
+        columns = self._columns
+        indices = columns.by_type.get(plate_type)
+        if indices is None:
+            return None
+
+        # A few random draws almost always succeed; fall back to filtering
+        for _ in range(8):
+            index = int(indices[rng.randrange(len(indices))])
+            if columns.filenames[index] not in exclude:
+                return self.plate(index, columns)
+        remaining = [int(i) for i in indices if columns.filenames[i] not in exclude]
+        return self.plate(rng.choice(remaining), columns) if remaining else None
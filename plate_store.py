@@ -0,0 +1,248 @@
+"""
+Memory-mapped store of preprocessed Ishihara plates.
+Every plate in a data directory is decoded and resized to 128×128 once and
+written as a single N×128×128×3 uint8 .npy file, with a JSON sidecar listing
+each row's filename, digit, font and colour type plus the source file's size
+and mtime. Readers map the file and slice plates without running PIL; the
+pages are shared between processes by the OS page cache.
+
+The pixels file is named after the sources it was built from
+(CBTestImages.plates.<hash>.npy) and the sidecar names it, so replacing the
+sidecar is the single step that publishes a new build: a reader never pairs
+new pixels with old metadata. Builds are serialised with a file lock, so
+workers starting together build the store once.
+
+The store is stale when any source plate is added, removed or modified; a
+rebuild only decodes the plates that changed and copies the other rows over.
+
+Usage:
+    python plate_store.py [--data-dir CBTestImages] [--rebuild]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+
+from ishihara_index import ISHIHARA_IMAGE_SIZE, read_plate_pixels
+from plate_manifest import parse_ishihara_filename
+
+STORE_VERSION = 2
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BASE_DIR, 'CBTestImages')
+
+
+def default_store_path(data_dir):
+    """
+    The store lives next to the plate directory. Its sidecar is named after this
+    path (CBTestImages.plates.json) and its pixels after the build
+    (CBTestImages.plates.<hash>.npy).
+    """
+    return os.path.normpath(data_dir) + '.plates.npy'
+
+
+def sidecar_path(store_path):
+    return os.path.splitext(store_path)[0] + '.json'
+
+
+def pixels_path(store_path, sources):
+    """Pixels file for a build from `sources`."""
+    digest = hashlib.sha256(json.dumps(sources, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return f"{os.path.splitext(store_path)[0]}.{digest}.npy"
+
+
+def referenced_pixels_path(store_path, meta):
+    return os.path.join(os.path.dirname(store_path), meta['pixels'])
+
+
+def scan_sources(data_dir):
+    """{filename: [size, mtime_ns]} for every parseable plate in the directory."""
+    sources = {}
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.png') and parse_ishihara_filename(entry.name):
+                stat = entry.stat()
+                sources[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+def load_sidecar(store_path):
+    try:
+        with open(sidecar_path(store_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != STORE_VERSION or meta.get('image_size') != list(ISHIHARA_IMAGE_SIZE):
+        return None
+    if not os.path.exists(referenced_pixels_path(store_path, meta)):
+        return None
+    return meta
+
+
+def is_fresh(meta, sources):
+    """True if the store was built from exactly these source files."""
+    return meta is not None and meta['sources'] == sources
+
+
+class build_lock:
+    """Exclusive lock on a store while it is (re)built; a no-op where fcntl is unavailable."""
+
+    def __init__(self, store_path):
+        self.path = os.path.splitext(store_path)[0] + '.lock'
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def build_store(data_dir, store_path=None, rebuild=False):
+    """
+    Write the store for `data_dir` and return its sidecar metadata.
+    Rows of an existing store whose source file is unchanged are reused.
+    The caller should hold build_lock(store_path).
+    """
+    store_path = store_path or default_store_path(data_dir)
+    sources = scan_sources(data_dir)
+    filenames = sorted(sources)
+
+    previous = None if rebuild else load_sidecar(store_path)
+    previous_rows = {}
+    previous_pixels = None
+    if previous is not None:
+        previous_pixels = np.load(referenced_pixels_path(store_path, previous), mmap_mode='r')
+        previous_rows = {
+            plate['filename']: i for i, plate in enumerate(previous['plates'])
+            if previous['sources'].get(plate['filename']) == sources.get(plate['filename'])
+        }
+
+    # Written under a temporary name and moved to its build-specific name, so
+    # readers never see a partial store
+    new_pixels_path = pixels_path(store_path, sources)
+    tmp_path = f"{new_pixels_path}.{os.getpid()}.tmp.npy"
+    pixels = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.uint8, shape=(len(filenames), *ISHIHARA_IMAGE_SIZE, 3))
+    changed = []
+    for i, filename in enumerate(filenames):
+        if filename in previous_rows:
+            pixels[i] = previous_pixels[previous_rows[filename]]
+        else:
+            changed.append(i)
+
+    # PIL releases the GIL while decoding, so changed plates are decoded in parallel
+    def decode(i):
+        pixels[i] = read_plate_pixels(os.path.join(data_dir, filenames[i]))
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        list(pool.map(decode, changed))
+    pixels.flush()
+
+    plates = [{'filename': filename, **parse_ishihara_filename(filename)} for filename in filenames]
+    del pixels, previous_pixels
+
+    meta = {
+        'version': STORE_VERSION,
+        'image_size': list(ISHIHARA_IMAGE_SIZE),
+        'pixels': os.path.basename(new_pixels_path),
+        'sources': sources,
+        'plates': plates
+    }
+    os.replace(tmp_path, new_pixels_path)
+    # Replacing the sidecar publishes the build
+    meta_tmp_path = f"{sidecar_path(store_path)}.{os.getpid()}.tmp"
+    with open(meta_tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(meta_tmp_path, sidecar_path(store_path))
+
+    # Earlier builds (and the unversioned file of STORE_VERSION 1); processes
+    # that already mapped one keep their mapping
+    stale = glob.glob(f"{glob.escape(os.path.splitext(store_path)[0])}.*.npy") + [store_path]
+    for path in stale:
+        if path != new_pixels_path and not path.endswith('.tmp.npy') and os.path.exists(path):
+            os.remove(path)
+    print(f"✓ Plate store built: {len(filenames)} plates ({len(changed)} decoded) → {new_pixels_path}")
+    return meta
+
+
+class PlateStore:
+    """
+    Read-only view of a built store.
+    `pixels` is the memory-mapped N×128×128×3 uint8 array; rows are in filename order.
+    """
+
+    def __init__(self, store_path, meta):
+        self.store_path = store_path
+        self.pixels_path = referenced_pixels_path(store_path, meta)
+        self.pixels = np.load(self.pixels_path, mmap_mode='r')
+        self.plates = meta['plates']
+        self.rows = {plate['filename']: i for i, plate in enumerate(self.plates)}
+        self.digits = np.array([plate['digit'] for plate in self.plates], dtype=np.int64)
+        self.fonts = [plate['font'] for plate in self.plates]
+        self.types = np.array([plate['type'] for plate in self.plates], dtype=np.int8)
+
+    @classmethod
+    def open(cls, data_dir, store_path=None, rebuild=False):
+        """Open the store for `data_dir`, building or refreshing it first if it is missing or stale."""
+        store_path = store_path or default_store_path(data_dir)
+        meta = None if rebuild else load_sidecar(store_path)
+        if is_fresh(meta, scan_sources(data_dir)):
+            try:
+                return cls(store_path, meta)
+            except FileNotFoundError:
+                # A concurrent build replaced the store between reading the sidecar and mapping it
+                pass
+
+        with build_lock(store_path):
+            # Another process may have built it while this one waited for the lock
+            meta = None if rebuild else load_sidecar(store_path)
+            if not is_fresh(meta, scan_sources(data_dir)):
+                meta = build_store(data_dir, store_path, rebuild=rebuild)
+            return cls(store_path, meta)
+
+    def __len__(self):
+        return len(self.plates)
+
+    def __contains__(self, filename):
+        return filename in self.rows
+
+    def __getitem__(self, filename):
+        """The uint8 pixels of one plate (a view into the mapped file)."""
+        return self.pixels[self.rows[filename]]
+
+    def images(self, filenames):
+        """Stack plates into a float32 batch scaled to [0, 1], as the digit model expects."""
+        rows = [self.rows[filename] for filename in filenames]
+        return self.pixels[rows].astype(np.float32) / 255.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the memory-mapped Ishihara plate store.')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Directory of Ishihara plates')
+    parser.add_argument('--store', default=None,
+                        help='Store path; its sidecar and pixels files are named after it (default: next to the data directory)')
+    parser.add_argument('--rebuild', action='store_true', help='Decode every plate even if the store is fresh')
+    args = parser.parse_args()
+
+    store = PlateStore.open(args.data_dir, args.store, rebuild=args.rebuild)
+    print(f"✓ {len(store)} plates, {store.pixels.nbytes / 1e6:.1f} MB → {store.pixels_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Content-addressed cache of /api/predict responses.
+The same fundus image is often uploaded more than once (retries, resubmits, the
+bundled sample images), so final responses - including validation rejections -
+are cached under a hash of the uploaded bytes and the served model's version.
+
+Entries live in an in-memory LRU bounded by total size and a TTL. An optional
+disk tier (one JSON file per entry) survives restarts and is shared by every
+worker process pointed at the same directory. It is swept in the background:
+expired files are deleted, then the oldest ones until the tier fits its budget.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# The disk tier is swept at most this often, unless it is over budget
+PURGE_INTERVAL = 60.0
+# A sweep of an over-budget disk tier deletes down to this share of the budget
+PURGE_LOW_WATER = 0.9
+
+
+class PredictionCache:
+    """
+    LRU + TTL cache mapping content keys to (payload, status) responses.
+
+    `max_bytes` caps the memory tier by the JSON size of the stored payloads;
+    0 disables caching. `disk_dir` enables the persistent tier, whose files
+    are capped at `max_disk_bytes` in total.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=3600.0, disk_dir=None,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl_seconds)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = int(max_disk_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0,
+                          'disk_evictions': 0, 'disk_expired': 0}
+        # Disk usage as of the last sweep plus what this process wrote since
+        self._disk_bytes = 0
+        self._disk_entries = 0
+        self._last_purge = 0.0
+        self._purging = False
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.purge_disk()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(data, model_version):
+        """Cache key for uploaded bytes as scored by a given model version."""
+        digest = hashlib.sha256()
+        digest.update(model_version.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _count(self, *names):
+        for name in names:
+            self._counters[name] += 1
+
+    def get(self, key):
+        """Return the cached (payload, status) for `key`, or None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, size, payload, status = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._count('hits', 'memory_hits')
+                    return payload, status
+                del self._entries[key]
+                self._bytes -= size
+                self._count('expired')
+
+        if self.disk_dir:
+            entry = self._read_disk(key, now)
+            if entry is not None:
+                payload, status, expires_at = entry
+                self._store(key, payload, status, expires_at)
+                with self._lock:
+                    self._count('hits', 'disk_hits')
+                return payload, status
+
+        with self._lock:
+            self._count('misses')
+        return None
+
+    def put(self, key, payload, status):
+        """Cache a response in memory and, if enabled, on disk."""
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        self._store(key, payload, status, expires_at)
+        if self.disk_dir:
+            self._write_disk(key, payload, status, expires_at)
+
+    def _store(self, key, payload, status, expires_at):
+        size = len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (expires_at, size, payload, status)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._count('evictions')
+
+    def _read_disk(self, key, now):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('expires_at', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._count('expired')
+            return None
+        return entry['payload'], entry['status'], entry['expires_at']
+
+    def _write_disk(self, key, payload, status, expires_at):
+        # Written atomically so a concurrent reader never sees a partial file
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'payload': payload, 'status': status, 'expires_at': expires_at}, f)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"❌ Error writing prediction cache entry: {str(e)}")
+            return
+
+        with self._lock:
+            self._disk_bytes += size
+            self._disk_entries += 1
+            due = (self._disk_bytes > self.max_disk_bytes
+                   or time.time() - self._last_purge >= PURGE_INTERVAL)
+            if due and not self._purging:
+                self._purging = True
+            else:
+                due = False
+        if due:
+            threading.Thread(target=self.purge_disk, name='prediction-cache-purge', daemon=True).start()
+
+    def purge_disk(self):
+        """
+        Sweep the disk tier: delete expired files, then the least recently
+        written ones until it fits in `max_disk_bytes`.
+        """
+        # A file expires `ttl` after it was written, so its mtime is enough
+        expired_before = time.time() - self.ttl
+        files = []
+        expired = 0
+        try:
+            for shard in os.scandir(self.disk_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if not entry.name.endswith('.json'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                        if stat.st_mtime <= expired_before:
+                            os.remove(entry.path)
+                            expired += 1
+                        else:
+                            files.append((stat.st_mtime, stat.st_size, entry.path))
+                    except OSError:
+                        # Deleted by another worker's sweep
+                        pass
+
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            if total > self.max_disk_bytes:
+                files.sort()
+                target = self.max_disk_bytes * PURGE_LOW_WATER
+                for _, size, path in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    total -= size
+                    evicted += 1
+        except OSError as e:
+            print(f"❌ Error sweeping prediction cache directory: {str(e)}")
+            with self._lock:
+                self._purging = False
+                self._last_purge = time.time()
+            return
+
+        with self._lock:
+            self._disk_bytes = total
+            self._disk_entries = len(files) - evicted
+            self._counters['disk_expired'] += expired
+            self._counters['disk_evictions'] += evicted
+            self._last_purge = time.time()
+            self._purging = False
+
+    def clear(self):
+        """Drop every in-memory entry (the disk tier is left alone)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counters, memory-tier occupancy and disk-tier usage."""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return {
+                **self._counters,
+                'hit_rate': round(self._counters['hits'] / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'disk_tier': bool(self.disk_dir),
+                'disk_entries': self._disk_entries,
+                'disk_bytes': self._disk_bytes,
+                'max_disk_bytes': self.max_disk_bytes
+            }
@@ -0,0 +1,208 @@
+"""
+Server-side store of Ishihara test sessions.
+A session records the plates handed out by start-test together with each
+plate's colour type and the model's answer, so /evaluate only has to compare
+the responses against it - no filename parsing, plate lookups or inference.
+
+Sessions live in an in-memory LRU bounded by total size and a TTL. An optional
+SQLite database makes them visible to every worker process (a test may be
+started on one gunicorn worker and evaluated on another) and survives restarts.
+
+Sessions that change after they are created (adaptive tests) carry a version
+number: update() only succeeds if nobody else has updated the session since it
+was read, and with the SQLite tier they are always read from the database, as
+another worker's memory copy may be stale.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Expired rows are deleted from the database at most this often
+PURGE_INTERVAL = 60.0
+
+
+class SessionStore:
+    """
+    LRU + TTL store mapping test ids to session dicts.
+
+    `max_bytes` caps the memory tier by the JSON size of the stored sessions.
+    `db_path` enables the SQLite tier, which holds every live session; the
+    memory tier then only saves a database read, and only holds sessions that
+    never change.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl_seconds=7200.0, db_path=None):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl_seconds)
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._counters = {'created': 0, 'hits': 0, 'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        if db_path:
+            with self._connection() as connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS sessions '
+                    '(test_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, data TEXT NOT NULL, version INTEGER)'
+                )
+                columns = [row[1] for row in connection.execute('PRAGMA table_info(sessions)')]
+                if 'version' not in columns:
+                    connection.execute('ALTER TABLE sessions ADD COLUMN version INTEGER')
+
+    def _connection(self):
+        # sqlite3 connections belong to the thread (and process) that opened them
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=5.0)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _count(self, *names):
+        for name in names:
+            self._counters[name] += 1
+
+    def put(self, test_id, session, mutable=False):
+        """
+        Store a new session; it expires `ttl_seconds` from now. A `mutable`
+        session can later be changed with update().
+        """
+        expires_at = time.time() + self.ttl
+        data = json.dumps(session)
+        version = 0 if mutable else None
+        if version is None or not self.db_path:
+            self._store(test_id, session, len(data), expires_at, version)
+        with self._lock:
+            self._count('created')
+        if self.db_path:
+            self._write_db(test_id, data, expires_at, version)
+
+    def get(self, test_id):
+        """Return the session for `test_id`, or None if it is unknown or has expired."""
+        return self.get_versioned(test_id)[0]
+
+    def get_versioned(self, test_id):
+        """
+        Return (session, version) for `test_id`, or (None, None). The version is
+        None for a session that cannot change; a mutable session is returned as
+        a copy to pass back to update().
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(test_id)
+            if entry is not None:
+                expires_at, size, session, version = entry
+                if expires_at > now:
+                    self._entries.move_to_end(test_id)
+                    self._count('hits', 'memory_hits')
+                    return (session if version is None else copy.deepcopy(session)), version
+                del self._entries[test_id]
+                self._bytes -= size
+                self._count('expired')
+
+        if self.db_path:
+            row = self._read_db(test_id, now)
+            if row is not None:
+                data, expires_at, version = row
+                session = json.loads(data)
+                if version is None:
+                    self._store(test_id, session, len(data), expires_at, version)
+                with self._lock:
+                    self._count('hits', 'db_hits')
+                return session, version
+
+        with self._lock:
+            self._count('misses')
+        return None, None
+
+    def update(self, test_id, session, version):
+        """
+        Replace a mutable session read at `version` and extend its expiry.
+        Returns False, leaving it unchanged, if it was updated by someone else
+        since (or has expired).
+        """
+        expires_at = time.time() + self.ttl
+        data = json.dumps(session)
+        if self.db_path:
+            return self._update_db(test_id, data, expires_at, version)
+        with self._lock:
+            entry = self._entries.get(test_id)
+            if entry is None or entry[0] <= time.time() or entry[3] != version:
+                return False
+            self._insert(test_id, session, len(data), expires_at, version + 1)
+        return True
+
+    def _store(self, test_id, session, size, expires_at, version=None):
+        with self._lock:
+            self._insert(test_id, session, size, expires_at, version)
+
+    def _insert(self, test_id, session, size, expires_at, version):
+        # Caller holds self._lock
+        previous = self._entries.pop(test_id, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        if size > self.max_bytes:
+            return
+        self._entries[test_id] = (expires_at, size, session, version)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._count('evictions')
+
+    def _read_db(self, test_id, now):
+        try:
+            row = self._connection().execute(
+                'SELECT data, expires_at, version FROM sessions WHERE test_id = ? AND expires_at > ?', (test_id, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"❌ Error reading test session: {str(e)}")
+            return None
+        return row
+
+    def _update_db(self, test_id, data, expires_at, version):
+        try:
+            with self._connection() as connection:
+                cursor = connection.execute(
+                    'UPDATE sessions SET data = ?, expires_at = ?, version = version + 1 '
+                    'WHERE test_id = ? AND version = ? AND expires_at > ?',
+                    (data, expires_at, test_id, version, time.time())
+                )
+        except sqlite3.Error as e:
+            print(f"❌ Error updating test session: {str(e)}")
+            return False
+        return cursor.rowcount == 1
+
+    def _write_db(self, test_id, data, expires_at, version=None):
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO sessions (test_id, expires_at, data, version) VALUES (?, ?, ?, ?)',
+                    (test_id, expires_at, data, version)
+                )
+                now = time.time()
+                if now - self._last_purge >= PURGE_INTERVAL:
+                    self._last_purge = now
+                    connection.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+        except sqlite3.Error as e:
+            print(f"❌ Error writing test session: {str(e)}")
+
+    def stats(self):
+        """Session counters and current memory-tier occupancy."""
+        with self._lock:
+            return {
+                **self._counters,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'db_tier': bool(self.db_path)
+            }
@@ -9,10 +9,14 @@ import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 from sklearn.model_selection import train_test_split
-from PIL import Image
-import re
 from collections import defaultdict
 import random
+from datetime import datetime, timezone
+
+from inference import CompiledModel, time_calls
+from ishihara_index import default_report_path, file_sha256, save_report
+from plate_manifest import parse_ishihara_filename
+from plate_store import PlateStore
 
 # Set random seeds for reproducibility
 np.random.seed(42)
@@ -29,48 +33,50 @@ DATA_DIR = r"C:\Users\adity\Downloads\archive\data"
 # We'll use 70% of fonts for training, 30% for validation
 TRAIN_SPLIT = 0.7
 
-def parse_filename(filename):
-    """
-    Parse Ishihara image filename to extract digit, font, and type.
-    Format: <digit>_<fontname>theme_<X> type_<Y>.png
-    """
-    match = re.match(r'(\d)_(.+?)theme_\d+ type_(\d)', filename)
-    if match:
-        digit = int(match.group(1))
-        font = match.group(2)
-        color_type = int(match.group(3))
-        return digit, font, color_type
-    return None, None, None
+# Decoded plates held in the shuffle buffer (about 48 KB each as uint8)
+SHUFFLE_BUFFER = 1000
+
+# Batch sizes and timed calls per batch size for the latency section of the evaluation report
+LATENCY_BATCH_SIZES = (1, 8, 32)
+LATENCY_ITERATIONS = 50
+
+# Architecture to train: 'standard' (Flatten → Dense) or 'compact' (separable convolutions + global pooling)
+MODEL_PROFILE = os.environ.get('OCULUSAI_ISHIHARA_PROFILE', 'standard')
+MODEL_PATHS = {
+    'standard': 'ishihara_digit_model.keras',
+    'compact': 'ishihara_digit_model_compact.keras'
+}
 
-def load_and_preprocess_image(image_path):
-    """Load and preprocess an image."""
-    img = Image.open(image_path).convert('RGB')
-    img = img.resize((IMG_SIZE, IMG_SIZE))
-    img_array = np.array(img) / 255.0  # Normalize to [0, 1]
-    return img_array
+# Optional teacher model (e.g. the standard model) to distill the new model from
+DISTILL_FROM = os.environ.get('OCULUSAI_DISTILL_FROM')
+DISTILL_ALPHA = 0.1
+DISTILL_TEMPERATURE = 4.0
 
-def load_dataset(data_dir, train_split=0.7):
+# A non-standard model is compared against the standard one on the same held-out fonts
+REFERENCE_MODEL_PATH = MODEL_PATHS['standard']
+COMPARISON_PATH = 'ishihara_model_comparison.json'
+COMPARISON_TOLERANCE = 0.005
+
+def split_by_font(data_dir, train_split=0.7):
     """
-    Load dataset and split into train/validation based on fonts.
+    Split the plates into train/validation based on fonts, from the filenames alone.
     Use train_split ratio of fonts for training, rest for validation.
+    Returns (train_paths, train_labels, val_paths, val_labels); nothing is decoded here.
     """
-    # Get all image files
-    all_files = [f for f in os.listdir(data_dir) if f.endswith('.png')]
-    
-    print(f"Total images found: {len(all_files)}")
-    
-    # Group files by font
+    # Group plate paths by font
     font_groups = defaultdict(list)
     type_stats = defaultdict(int)
     digit_stats = defaultdict(int)
     
-    for filename in all_files:
-        digit, font, color_type = parse_filename(filename)
-        if digit is not None:
-            font_groups[font].append((filename, digit))
-            type_stats[color_type] += 1
-            digit_stats[digit] += 1
+    for filename in sorted(os.listdir(data_dir)):
+        plate = parse_ishihara_filename(filename) if filename.endswith('.png') else None
+        if plate is None:
+            continue
+        font_groups[plate['font']].append((os.path.join(data_dir, filename), plate['digit']))
+        type_stats[plate['type']] += 1
+        digit_stats[plate['digit']] += 1
     
+    print(f"Total images found: {sum(len(group) for group in font_groups.values())}")
     print(f"\nDataset statistics:")
     print(f"Unique fonts: {len(font_groups)}")
     print(f"Color types distribution: {dict(type_stats)}")
@@ -87,34 +93,48 @@ def load_dataset(data_dir, train_split=0.7):
     print(f"\nTrain fonts ({len(train_fonts)}): {train_fonts[:5]}...")
     print(f"Val fonts ({len(val_fonts)}): {val_fonts[:5]}...")
     
-    # Load images
-    train_images = []
-    train_labels = []
-    val_images = []
-    val_labels = []
-    
-    for font, files in font_groups.items():
-        for filename, digit in files:
-            image_path = os.path.join(data_dir, filename)
-            img_array = load_and_preprocess_image(image_path)
-            
-            if font in train_fonts:
-                train_images.append(img_array)
-                train_labels.append(digit)
-            else:
-                val_images.append(img_array)
-                val_labels.append(digit)
-    
-    # Convert to numpy arrays
-    X_train = np.array(train_images)
-    y_train = np.array(train_labels)
-    X_val = np.array(val_images)
-    y_val = np.array(val_labels)
-    
-    print(f"\nTraining set: {len(X_train)} images")
-    print(f"Validation set: {len(X_val)} images")
-    
-    return X_train, y_train, X_val, y_val
+    train_plates = [item for font in train_fonts for item in font_groups[font]]
+    val_plates = [item for font in val_fonts for item in font_groups[font]]
+    
+    # Fonts are contiguous after grouping; shuffle the file list once so the bounded
+    # shuffle buffer in the pipeline still sees a mix of fonts on large corpora
+    random.shuffle(train_plates)
+    
+    print(f"\nTraining set: {len(train_plates)} images")
+    print(f"Validation set: {len(val_plates)} images")
+    
+    def unzip(plates):
+        paths = [path for path, _ in plates]
+        labels = np.array([digit for _, digit in plates], dtype=np.int64)
+        return paths, labels
+    
+    return (*unzip(train_plates), *unzip(val_plates))
+
+def normalize(images, labels):
+    """Scale a uint8 batch to [0, 1], as the model expects."""
+    return tf.cast(images, tf.float32) / 255.0, labels
+
+def make_dataset(store, paths, labels, training=False):
+    """
+    Streaming input pipeline over the plate store (plate_store.py), which holds every plate
+    already decoded and resized by the same PIL code the server uses. Rows are sliced from
+    the memory-mapped store with a parallel map and kept uint8 until batching, so only the
+    shuffle buffer and a few batches are in memory at once, however large the corpus.
+    """
+    rows = np.array([store.rows[os.path.basename(path)] for path in paths], dtype=np.int64)
+    
+    def read_plate(row, label):
+        image = tf.numpy_function(lambda r: store.pixels[r], [row], tf.uint8)
+        image.set_shape((IMG_SIZE, IMG_SIZE, 3))
+        return image, label
+    
+    dataset = tf.data.Dataset.from_tensor_slices((rows, labels))
+    dataset = dataset.map(read_plate, num_parallel_calls=tf.data.AUTOTUNE)
+    
+    if training:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, reshuffle_each_iteration=True)
+    
+    return dataset.batch(BATCH_SIZE).map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
 
 def create_model(input_shape=(IMG_SIZE, IMG_SIZE, 3), num_classes=10):
     """
@@ -172,8 +192,92 @@ def create_model(input_shape=(IMG_SIZE, IMG_SIZE, 3), num_classes=10):
     
     return model
 
-def train_model(model, X_train, y_train, X_val, y_val):
-    """Train the model with data augmentation and callbacks."""
+def create_compact_model(input_shape=(IMG_SIZE, IMG_SIZE, 3), num_classes=10):
+    """
+    Create a compact CNN for digit classification.
+    Depthwise-separable blocks and global average pooling replace the standard
+    model's Flatten → Dense(512), which alone holds about 8.4M weights.
+    """
+    model = keras.Sequential([
+        # Input layer
+        layers.Input(shape=input_shape),
+        
+        # Stem: a full convolution, so colour channels are mixed from the start
+        layers.Conv2D(32, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        
+        # Separable blocks
+        layers.SeparableConv2D(64, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.SeparableConv2D(64, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        layers.Dropout(0.2),
+        
+        layers.SeparableConv2D(128, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.SeparableConv2D(128, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        layers.Dropout(0.2),
+        
+        layers.SeparableConv2D(256, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.SeparableConv2D(256, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        
+        # Pool to one 256-vector instead of flattening
+        layers.GlobalAveragePooling2D(),
+        layers.Dropout(0.4),
+        
+        # Output layer
+        layers.Dense(num_classes, activation='softmax')
+    ])
+    
+    return model
+
+MODEL_BUILDERS = {
+    'standard': create_model,
+    'compact': create_compact_model
+}
+
+class Distiller(keras.Model):
+    """
+    Trains `student` on the labels and on the teacher's softened predictions.
+    Both models end in a softmax, so their log-probabilities stand in for logits.
+    """
+    
+    def __init__(self, student, teacher, alpha=DISTILL_ALPHA, temperature=DISTILL_TEMPERATURE):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.teacher.trainable = False
+        self.alpha = alpha
+        self.temperature = temperature
+        self.student_loss_fn = keras.losses.SparseCategoricalCrossentropy()
+        self.distillation_loss_fn = keras.losses.KLDivergence()
+    
+    def soften(self, probabilities):
+        return keras.ops.softmax(keras.ops.log(probabilities + 1e-7) / self.temperature)
+    
+    def call(self, x, training=False):
+        return self.student(x, training=training)
+    
+    def compute_loss(self, x=None, y=None, y_pred=None, sample_weight=None, training=True):
+        teacher_pred = self.teacher(x, training=False)
+        student_loss = self.student_loss_fn(y, y_pred)
+        distillation_loss = self.distillation_loss_fn(self.soften(teacher_pred), self.soften(y_pred))
+        return self.alpha * student_loss + (1 - self.alpha) * distillation_loss * self.temperature ** 2
+
+def train_model(model, train_dataset, val_dataset, teacher=None):
+    """
+    Train the model with data augmentation and callbacks.
+    With a `teacher`, the model is distilled from it (see Distiller).
+    """
+    student = model
+    if teacher is not None:
+        model = Distiller(student, teacher)
     
     # Compile model
     model.compile(
@@ -194,12 +298,9 @@ def train_model(model, X_train, y_train, X_val, y_val):
         images = data_augmentation(images, training=True)
         return images, labels
     
-    # Create datasets
-    train_dataset = tf.data.Dataset.from_tensor_slices((X_train, y_train))
-    train_dataset = train_dataset.shuffle(1000).batch(BATCH_SIZE).map(augment).prefetch(tf.data.AUTOTUNE)
-    
-    val_dataset = tf.data.Dataset.from_tensor_slices((X_val, y_val))
-    val_dataset = val_dataset.batch(BATCH_SIZE).prefetch(tf.data.AUTOTUNE)
+    # Augment the streamed batches and overlap input with training
+    train_dataset = train_dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+    val_dataset = val_dataset.prefetch(tf.data.AUTOTUNE)
     
     # Callbacks
     callbacks = [
@@ -224,6 +325,10 @@ def train_model(model, X_train, y_train, X_val, y_val):
             verbose=1
         )
     ]
+    if teacher is not None:
+        # A checkpoint would hold the whole Distiller; the student is saved after
+        # training instead, once EarlyStopping has restored its best weights
+        callbacks = callbacks[1:]
     
     # Train model
     print("\n" + "="*60)
@@ -238,41 +343,145 @@ def train_model(model, X_train, y_train, X_val, y_val):
         verbose=1
     )
     
+    if teacher is not None:
+        student.save('best_ishihara_model.keras')
+    
     return history
 
-def evaluate_model(model, X_val, y_val):
-    """Evaluate model and show detailed metrics."""
+def accuracy_by_group(correct, groups):
+    """Accuracy and sample count for each distinct value in `groups`."""
+    names, codes = np.unique(np.asarray(groups), return_inverse=True)
+    totals = np.bincount(codes, minlength=len(names))
+    hits = np.bincount(codes, weights=correct, minlength=len(names))
+    return {
+        str(name): {'accuracy': round(float(hit / total), 4), 'samples': int(total)}
+        for name, hit, total in zip(names, hits, totals)
+    }
+
+def measure_latency(model, images, batch_sizes=LATENCY_BATCH_SIZES, iterations=LATENCY_ITERATIONS):
+    """Forward-pass latency and throughput at each batch size, on real validation plates."""
+    results = []
+    for batch_size in batch_sizes:
+        batch = images[np.arange(batch_size) % len(images)]
+        latencies = time_calls(model, batch, iterations)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        results.append({
+            'batch_size': batch_size,
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'images_per_sec': round(float(batch_size * 1000 / np.median(latencies)), 1)
+        })
+    return results
+
+def evaluate_model(model, val_dataset, val_paths, y_val):
+    """
+    Evaluate model and show detailed metrics, from a single inference pass over
+    `val_dataset` (unshuffled, in the order of `val_paths` and `y_val`).
+    Returns the evaluation report.
+    """
     print("\n" + "="*60)
     print("Model Evaluation")
     print("="*60 + "\n")
     
+    # Same traced forward pass the server uses
+    compiled = CompiledModel(model, (IMG_SIZE, IMG_SIZE, 3))
+    predictions = []
+    latency_images = None
+    for images, _ in val_dataset:
+        if latency_images is None:
+            latency_images = images.numpy()
+        predictions.append(compiled(images))
+    predictions = np.concatenate(predictions)
+    predicted_labels = np.argmax(predictions, axis=1)
+    
     # Overall accuracy
-    val_loss, val_accuracy = model.evaluate(X_val, y_val, verbose=0)
+    true_probabilities = predictions[np.arange(len(y_val)), y_val]
+    val_loss = float(-np.mean(np.log(np.clip(true_probabilities, 1e-7, 1.0))))
+    correct = predicted_labels == y_val
+    val_accuracy = float(np.mean(correct))
     print(f"Validation Loss: {val_loss:.4f}")
     print(f"Validation Accuracy: {val_accuracy*100:.2f}%")
     
-    # Per-digit accuracy
-    predictions = model.predict(X_val, verbose=0)
-    predicted_labels = np.argmax(predictions, axis=1)
+    # Rows are true digits, columns predicted digits
+    confusion = np.bincount(y_val * 10 + predicted_labels, minlength=100).reshape(10, 10)
     
     print("\nPer-digit accuracy:")
-    for digit in range(10):
-        mask = y_val == digit
-        if np.sum(mask) > 0:
-            digit_accuracy = np.mean(predicted_labels[mask] == digit)
-            print(f"  Digit {digit}: {digit_accuracy*100:.2f}% ({np.sum(mask)} samples)")
+    digit_totals = confusion.sum(axis=1)
+    for digit in np.flatnonzero(digit_totals):
+        digit_accuracy = confusion[digit, digit] / digit_totals[digit]
+        print(f"  Digit {digit}: {digit_accuracy*100:.2f}% ({digit_totals[digit]} samples)")
     
     # Confusion analysis
     print("\nMost common misclassifications:")
-    errors = predicted_labels != y_val
-    if np.sum(errors) > 0:
-        error_pairs = defaultdict(int)
-        for true_label, pred_label in zip(y_val[errors], predicted_labels[errors]):
-            error_pairs[(true_label, pred_label)] += 1
-        
-        sorted_errors = sorted(error_pairs.items(), key=lambda x: x[1], reverse=True)
-        for (true_label, pred_label), count in sorted_errors[:5]:
-            print(f"  {true_label} → {pred_label}: {count} times")
+    errors = confusion.copy()
+    np.fill_diagonal(errors, 0)
+    for flat in np.argsort(errors, axis=None, kind='stable')[::-1][:5]:
+        true_label, pred_label = divmod(int(flat), 10)
+        if errors[true_label, pred_label] > 0:
+            print(f"  {true_label} → {pred_label}: {errors[true_label, pred_label]} times")
+    
+    plates = [parse_ishihara_filename(os.path.basename(path)) for path in val_paths]
+    
+    print("\nInference latency:")
+    latency = measure_latency(compiled, latency_images)
+    for result in latency:
+        print(f"  Batch {result['batch_size']}: {result['p50_ms']:.2f} ms p50, "
+              f"{result['images_per_sec']:.0f} images/sec")
+    
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'samples': len(y_val),
+        'loss': round(val_loss, 4),
+        'accuracy': round(val_accuracy, 4),
+        'confusion_matrix': confusion.tolist(),
+        'per_digit': accuracy_by_group(correct, y_val),
+        'per_font': accuracy_by_group(correct, [plate['font'] for plate in plates]),
+        'per_type': accuracy_by_group(correct, [plate['type'] for plate in plates]),
+        'latency': latency
+    }
+
+def model_summary(model, model_path, report):
+    """Size, single-image latency and held-out accuracy of one model, for the comparison."""
+    single = next(result for result in report['latency'] if result['batch_size'] == 1)
+    return {
+        'path': model_path,
+        'parameters': int(model.count_params()),
+        'file_size_bytes': os.path.getsize(model_path),
+        'latency_p50_ms': single['p50_ms'],
+        'latency_p95_ms': single['p95_ms'],
+        'accuracy': report['accuracy']
+    }
+
+def compare_models(candidate, reference, tolerance=COMPARISON_TOLERANCE):
+    """
+    Comparison of a candidate model against the reference, both summarised by
+    model_summary() on the same held-out fonts. `matches_reference` is True when
+    the candidate's accuracy is within `tolerance` of the reference.
+    """
+    comparison = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'reference': reference,
+        'candidate': candidate,
+        'parameter_ratio': round(candidate['parameters'] / reference['parameters'], 4),
+        'file_size_ratio': round(candidate['file_size_bytes'] / reference['file_size_bytes'], 4),
+        'latency_speedup': round(reference['latency_p50_ms'] / candidate['latency_p50_ms'], 2),
+        'accuracy_delta': round(candidate['accuracy'] - reference['accuracy'], 4),
+        'matches_reference': candidate['accuracy'] >= reference['accuracy'] - tolerance
+    }
+    
+    print("\n" + "="*60)
+    print("Model Comparison")
+    print("="*60 + "\n")
+    print(f"{'':>16}{'Reference':>16}{'Candidate':>16}")
+    print(f"{'Parameters':>16}{reference['parameters']:>16,}{candidate['parameters']:>16,}")
+    print(f"{'File size (MB)':>16}{reference['file_size_bytes'] / 1e6:>16.2f}{candidate['file_size_bytes'] / 1e6:>16.2f}")
+    print(f"{'Latency p50 (ms)':>16}{reference['latency_p50_ms']:>16.2f}{candidate['latency_p50_ms']:>16.2f}")
+    print(f"{'Accuracy':>16}{reference['accuracy']*100:>15.2f}%{candidate['accuracy']*100:>15.2f}%")
+    print(f"\nCandidate {'matches' if comparison['matches_reference'] else 'does not match'} the reference "
+          f"(accuracy within {tolerance*100:.1f} points), {comparison['latency_speedup']}x faster at batch 1")
+    
+    return comparison
 
 def main():
     """Main training pipeline."""
@@ -287,27 +496,54 @@ def main():
     
     # Load dataset
     print("\nLoading dataset...")
-    X_train, y_train, X_val, y_val = load_dataset(DATA_DIR, TRAIN_SPLIT)
+    train_paths, y_train, val_paths, y_val = split_by_font(DATA_DIR, TRAIN_SPLIT)
+    # Built on first use; later runs only decode plates that were added or changed
+    store = PlateStore.open(DATA_DIR)
+    train_dataset = make_dataset(store, train_paths, y_train, training=True)
+    val_dataset = make_dataset(store, val_paths, y_val)
     
     # Create model
-    print("\nCreating model...")
-    model = create_model()
+    print(f"\nCreating {MODEL_PROFILE} model...")
+    model = MODEL_BUILDERS[MODEL_PROFILE]()
     model.summary()
     
+    teacher = None
+    if DISTILL_FROM:
+        print(f"\nDistilling from: {DISTILL_FROM}")
+        teacher = keras.models.load_model(DISTILL_FROM)
+    
     # Train model
-    history = train_model(model, X_train, y_train, X_val, y_val)
+    history = train_model(model, train_dataset, val_dataset, teacher=teacher)
     
     # Load best model
     print("\nLoading best model...")
     model = keras.models.load_model('best_ishihara_model.keras')
     
     # Evaluate
-    evaluate_model(model, X_val, y_val)
+    report = evaluate_model(model, val_dataset, val_paths, y_val)
     
     # Save final model
-    final_model_path = 'ishihara_digit_model.keras'
+    final_model_path = MODEL_PATHS[MODEL_PROFILE]
     model.save(final_model_path)
     print(f"\n✓ Final model saved as: {final_model_path}")
+    
+    # The report is tied to the saved file, so serving can tell whether it describes the model it loads
+    report['model'] = {'path': final_model_path, 'profile': MODEL_PROFILE, 'sha256': file_sha256(final_model_path)}
+    report_path = default_report_path(final_model_path)
+    save_report(report, report_path)
+    print(f"✓ Evaluation report saved as: {report_path}")
+    
+    # Compare against the standard model on the same held-out fonts
+    if final_model_path != REFERENCE_MODEL_PATH and os.path.exists(REFERENCE_MODEL_PATH):
+        print(f"\nEvaluating reference model: {REFERENCE_MODEL_PATH}")
+        reference_model = keras.models.load_model(REFERENCE_MODEL_PATH)
+        reference_report = evaluate_model(reference_model, val_dataset, val_paths, y_val)
+        comparison = compare_models(
+            model_summary(model, final_model_path, report),
+            model_summary(reference_model, REFERENCE_MODEL_PATH, reference_report)
+        )
+        save_report(comparison, COMPARISON_PATH)
+        print(f"✓ Comparison saved as: {COMPARISON_PATH}")
     print(f"✓ Model is ready for integration with Flask backend!")
     
     print("\n" + "="*60)